@@ -0,0 +1,114 @@
+import json
+import os
+import threading
+import time
+
+from logger_config import logging
+
+# Consolidated analysis view the upload flow and /json_file use; each paper's log sits next to it
+ANALYSIS_PATH = "generated_files/analysis.json"
+FSYNC_EVERY = 16
+FSYNC_INTERVAL = 1.0
+
+_path_locks = {}
+_path_locks_guard = threading.Lock()
+
+def _lock_for(path):
+    with _path_locks_guard:
+        return _path_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+def log_path_for(outfile_path: str, paper_id) -> str:
+    """
+    The append-only log of one paper backing a consolidated JSON view, e.g. analysis.json ->
+    analysis.qp_1.jsonl. Each paper has its own log, so a log only grows when that paper is
+    re-analysed instead of with every upload.
+    """
+    return f"{os.path.splitext(outfile_path)[0]}.{paper_id}.jsonl"
+
+class AnalysisLog:
+    """
+    Append-only JSON Lines log of question analyses.
+
+    Every record is flushed as soon as it is appended, so pollers see it at once,
+    while fsync is batched to every `fsync_every` records or `fsync_interval` seconds.
+    A crash can only lose the unsynced tail, never corrupt earlier records. With restart=True
+    the log is emptied first, which readers notice by their offset passing its end.
+    """
+    def __init__(self, path: str, fsync_every: int = FSYNC_EVERY, fsync_interval: float = FSYNC_INTERVAL,
+                 restart: bool = False):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._lock = _lock_for(path)
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "w" if restart else "a", encoding="utf-8")
+
+    def append(self, paper_id, question_no, analysis: dict):
+        line = json.dumps({"paper": paper_id, "qno": question_no, "analysis": analysis}, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_log(path: str, offset: int = 0):
+    """
+    Returns (records, next_offset) for the complete lines written after byte `offset`.
+    A partially written last line is left for the next read. An offset past the end means
+    the log was restarted since, so it is read again from the start.
+    """
+    if not os.path.exists(path):
+        return [], offset
+    with open(path, "rb") as f:
+        if offset > os.fstat(f.fileno()).st_size:
+            offset = 0
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b"\n") + 1
+    records = []
+    for line in data[:end].splitlines():
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            logging.warning(f"Skipping unreadable line in {path}")
+    return records, offset + end
+
+def compact(path: str, out_path: str, paper_id=None) -> dict:
+    """
+    Builds the consolidated {question_no: analysis} view from the log (latest record wins),
+    optionally for one paper, and writes it atomically to out_path. An empty view never
+    replaces an existing file.
+    """
+    records, _ = read_log(path)
+    view = {}
+    for record in records:
+        if paper_id is None or record["paper"] == paper_id:
+            view[str(record["qno"])] = record["analysis"]
+    if not view and os.path.exists(out_path):
+        logging.warning(f"No analyses in {path}, keeping {out_path}")
+        return view
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(view, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_path, out_path)
+    return view
@@ -0,0 +1,92 @@
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from database import db
+from logger_config import logging
+
+EXPORT_BATCH_ROWS = 65536
+EXPORT_SCHEMA = pa.schema([
+    ("student_id", pa.string()),
+    ("paper_id", pa.string()),
+    ("qno", pa.int32()),
+    ("score", pa.float64()),
+    ("subject", pa.string()),
+    ("topic", pa.string()),
+    ("difficulty", pa.float64()),
+    ("taxonomy", pa.string()),
+    ("student_option", pa.string()),
+])
+# File extensions written as Arrow IPC files rather than Parquet
+ARROW_EXTENSIONS = (".arrow", ".feather", ".ipc")
+
+def export_format(path: str) -> str:
+    return "arrow" if path.lower().endswith(ARROW_EXTENSIONS) else "parquet"
+
+def iter_batches(cursor, paper_id: str = None, student_id: str = None, batch_size: int = EXPORT_BATCH_ROWS):
+    """
+    Yields graded report rows as pyarrow RecordBatches of at most batch_size rows, optionally
+    for one paper and/or student. Rows come straight off the cursor, so memory stays bounded
+    by the batch size. There is no ORDER BY, which would make SQLite sort the whole result.
+    """
+    query = '''
+    SELECT t.student_id, t.paper_id, r.qno, r.Score, a.subject, a.topic, a.diff, a.Taxonomy, r.stud_op
+    FROM attempts t
+    JOIN responses r ON r.attempt_id = t.attempt_id
+    LEFT JOIN analyses a ON a.paper_id = t.paper_id AND a.qno = r.qno'''
+    conditions, params = [], []
+    if paper_id is not None:
+        conditions.append("t.paper_id = ?")
+        params.append(paper_id)
+    if student_id is not None:
+        conditions.append("t.student_id = ?")
+        params.append(student_id)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+
+    cursor.execute(query, params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, EXPORT_SCHEMA)],
+            schema=EXPORT_SCHEMA)
+
+def export_results(path: str, paper_id: str = None, student_id: str = None, batch_size: int = EXPORT_BATCH_ROWS,
+                   fmt: str = None, connection=None) -> int:
+    """
+    Streams graded report rows into a Parquet file, or an Arrow IPC file when fmt is "arrow"
+    (by default inferred from the extension, see ARROW_EXTENSIONS). Arrow files are written
+    uncompressed so they can be memory-mapped with open_arrow. The file is written next to
+    path and renamed into place once complete. Returns the number of rows written.
+    """
+    fmt = fmt or export_format(path)
+    if fmt not in ("parquet", "arrow"):
+        raise ValueError(f"Unknown export format {fmt!r}, expected 'parquet' or 'arrow'")
+    cursor = (connection or db.connection()).cursor()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    rows = 0
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(tmp_path, EXPORT_SCHEMA, compression="zstd")
+    else:
+        writer = pa.ipc.new_file(tmp_path, EXPORT_SCHEMA)
+    try:
+        for batch in iter_batches(cursor, paper_id, student_id, batch_size):
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    except BaseException:
+        writer.close()
+        os.remove(tmp_path)
+        raise
+    writer.close()
+    os.replace(tmp_path, path)
+    logging.info(f"Exported {rows} report rows to {path} ({fmt})")
+    return rows
+
+def open_arrow(path: str) -> pa.Table:
+    """Loads an Arrow IPC export through a memory map, so columns are read without copying."""
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
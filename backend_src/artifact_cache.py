@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from logger_config import logging
+
+CACHE_DIR = 'generated_files/cache'
+MAX_ENTRIES = 256
+MAX_BYTES = 64 * 1024 * 1024
+
+def sha256_file(path, block_size=1024 * 1024):
+    """Returns the hex SHA-256 digest of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ArtifactCache:
+    """
+    Content-addressed cache of parsed upload artifacts.
+
+    Entries are JSON files named after the SHA-256 digests of the uploaded PDFs, so
+    re-uploading byte-identical files skips extraction and merging. The least recently
+    used entries are evicted once either max_entries or max_bytes is exceeded.
+    """
+    def __init__(self, cache_dir=CACHE_DIR, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Rebuild the LRU order from the files left by previous runs
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json'):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, name[:-len('.json')], stat.st_size))
+        self._index = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self._total_bytes = sum(self._index.values())
+
+    def key_for(self, *paths):
+        return '_'.join(sha256_file(path) for path in paths)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._index:
+                self.misses += 1
+                self._log('miss', key)
+                return None
+            try:
+                with open(self._path(key), 'r', encoding='utf-8') as f:
+                    artifact = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logging.warning(f"Dropping unreadable cache entry {key[:12]}: {e}")
+                self._remove(key)
+                self.misses += 1
+                self._log('miss', key)
+                return None
+            self._index.move_to_end(key)
+            os.utime(self._path(key))
+            self.hits += 1
+            self._log('hit', key)
+            return artifact
+
+    def put(self, key, artifact):
+        data = json.dumps(artifact, ensure_ascii=False).encode('utf-8')
+        with self._lock:
+            tmp_path = self._path(key) + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+            if key in self._index:
+                self._total_bytes -= self._index.pop(key)
+            self._index[key] = len(data)
+            self._total_bytes += len(data)
+            self._evict()
+
+    def _evict(self):
+        while len(self._index) > 1 and (len(self._index) > self.max_entries or self._total_bytes > self.max_bytes):
+            key = next(iter(self._index))
+            logging.info(f"Evicting artifact cache entry {key[:12]}")
+            self._remove(key)
+
+    def _remove(self, key):
+        self._total_bytes -= self._index.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _log(self, outcome, key):
+        logging.info(f"Artifact cache {outcome} for {key[:12]} (hits={self.hits}, misses={self.misses})")
@@ -0,0 +1,133 @@
+"""
+Benchmark: question analysis throughput against the offline Gemini stand-in.
+
+Runs AIModelEvaluator.generate_explanations_single_file and Assistant() on synthetic
+papers, with no network access and no API quota used. Prompt and output tokens per
+question are summed from each response's usage_metadata, as on the live API; the offline
+stand-in fills it in at 4 characters per token, so those figures are an estimate of real
+Gemini token counts, good for comparing batch sizes. Both modes run the same metadata tier
+(--metadata-tier, default "off": every field from Gemini), so they measure the same work.
+Run from backend_src:
+
+    python benchmarks/bench_analysis.py --sizes 10 100 1000 --concurrency 8 --batch-size 1
+"""
+import argparse
+import contextlib
+import io
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import logging
+
+from database import db, save_questions
+from explain_gem import AIModelEvaluator, APIKeyManager, Assistant
+from llm_cache import LLMResponseCache
+from llm_metrics import LLMMetrics
+from metadata_classifier import trained_classifier
+from offline_gemini import lognormal_latency, offline_client_factory
+
+def make_questions(n, tag):
+    """Synthetic paper; the tag keeps question texts unique across runs so the LLM cache never hits."""
+    return [{
+        "Question no": i,
+        "Question": f"[{tag}] A body moves with velocity {i} m/s for {i % 7 + 1} s. How far does it travel?",
+        "options": {1: f"{i} m", 2: f"{i * (i % 7 + 1)} m", 3: f"{2 * i} m", 4: "0 m"},
+        "Correct Answer": 2,
+    } for i in range(1, n + 1)]
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(math.ceil(pct / 100 * len(values))) - 1)]
+
+def run(mode, n, args):
+    keys = [f"offline-key-{i}" for i in range(args.keys)]
+    factory = offline_client_factory(latency=lognormal_latency(args.latency_ms / 1000, args.sigma),
+                                     exhausted_rate=args.exhausted_rate, malformed_rate=args.malformed_rate,
+                                     seed=n)
+    questions = make_questions(n, f"{mode}-{n}-{time.time()}")
+    paper_id = f"bench_{mode.lower()}_{n}"
+    output_path = "generated_files/analysis.json"
+    # Analyses reference their paper's question rows
+    save_questions(paper_id, questions)
+
+    metrics = LLMMetrics()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if mode == "evaluator":
+            # Assistant only uses the classifier for unbatched requests
+            classifier = None
+            if args.metadata_tier == "local" and args.batch_size == 1:
+                classifier = trained_classifier(db.connection())
+            with contextlib.closing(LLMResponseCache("Database/bench_llm_cache.db")) as cache:
+                evaluator = AIModelEvaluator(
+                    api_key_manager=APIKeyManager(keys, requests_per_minute=args.rpm),
+                    concurrency=args.concurrency,
+                    cache=cache,
+                    client_factory=factory,
+                    metrics=metrics,
+                    classifier=classifier,
+                )
+                evaluator.generate_explanations_single_file(paper_id, questions, output_path, batch_size=args.batch_size)
+        else:
+            os.environ["GEMINI_API_KEYS"] = ",".join(keys)
+            os.environ["GEMINI_API_KEY"] = ""
+            Assistant(questions, paper_id, output_path=output_path, concurrency=args.concurrency,
+                      requests_per_minute=args.rpm, batch_size=args.batch_size, client_factory=factory, metrics=metrics,
+                      metadata_tier=args.metadata_tier)
+    elapsed = time.perf_counter() - start
+
+    calls = sum(model.stats["calls"] for model in factory.models)
+    exhausted = sum(model.stats["exhausted"] for model in factory.models)
+    malformed = sum(model.stats["malformed"] for model in factory.models)
+    latencies = [latency for model in factory.models for latency in model.stats["latencies"]]
+    minimum_calls = math.ceil(n / args.batch_size)
+    usage = metrics.summary()
+    return {
+        "mode": mode, "questions": n, "seconds": elapsed, "qps": n / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else 0.0,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "calls": calls, "exhausted": exhausted, "malformed": malformed,
+        "retry_overhead": (calls - minimum_calls) / minimum_calls,
+        "prompt_tokens": usage["prompt_tokens"] / n, "output_tokens": usage["output_tokens"] / n,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--modes", nargs="+", default=["evaluator", "Assistant"], choices=["evaluator", "Assistant"])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--keys", type=int, default=4)
+    parser.add_argument("--rpm", type=float, default=6000, help="requests per minute per key")
+    parser.add_argument("--latency-ms", type=float, default=50, help="median simulated call latency")
+    parser.add_argument("--sigma", type=float, default=0.5, help="lognormal latency spread")
+    parser.add_argument("--exhausted-rate", type=float, default=0.02)
+    parser.add_argument("--malformed-rate", type=float, default=0.01)
+    parser.add_argument("--metadata-tier", default="off", choices=["off", "local"],
+                        help="where subject, topic and difficulty come from, in both modes")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.makedirs("Database")
+        os.makedirs("generated_files")
+        print(f"metadata tier: {args.metadata_tier}")
+        print(f"{'mode':>10} {'questions':>9} {'seconds':>8} {'q/s':>8} {'p50 ms':>7} {'p95 ms':>7} "
+              f"{'calls':>6} {'429s':>5} {'bad json':>8} {'retry ovh':>9} {'prompt tok/q':>12} {'output tok/q':>12}")
+        for n in args.sizes:
+            for mode in args.modes:
+                r = run(mode, n, args)
+                print(f"{r['mode']:>10} {r['questions']:>9} {r['seconds']:>8.2f} {r['qps']:>8.1f} {r['p50_ms']:>7.1f} "
+                      f"{r['p95_ms']:>7.1f} {r['calls']:>6} {r['exhausted']:>5} {r['malformed']:>8} {r['retry_overhead']:>8.1%} "
+                      f"{r['prompt_tokens']:>12.0f} {r['output_tokens']:>12.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Benchmark: per-row commits on the rollback journal vs the shared WAL connection with batched writes.
+
+Writes synthetic response rows from several threads at once, as concurrent gradings do.
+The legacy writer opens its own connection, re-runs the schema and commits every row,
+as the populate functions used to; the new one goes through ConnectionManager and
+BatchWriter. Run from backend_src:  python benchmarks/bench_db_writes.py
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import SCHEMA, ConnectionManager, response_hash, response_writer, start_attempt
+
+ROW_COUNTS = [300, 3000]
+WRITER_COUNTS = [1, 4]
+
+def rows_for(attempt_id, rows):
+    """(attempt_id, qno, stud_op, Score, Error_exp, Feedback, content_hash) rows."""
+    rows = [(f"Option{qno % 4 + 1}", 4 if qno % 3 else -1, "NA", "Feedback " * 20) for qno in range(1, rows + 1)]
+    return [(attempt_id, qno, *content, response_hash(content)) for qno, content in enumerate(rows, start=1)]
+
+def setup(path, writers, legacy=False, paper_id="qp_bench"):
+    """Creates the schema, one paper and one attempt per writer. Returns the attempt ids."""
+    manager = ConnectionManager(path)
+    connection = manager.connection()
+    with connection:
+        connection.execute("INSERT OR IGNORE INTO papers (paper_id, created_at) VALUES (?, ?)", (paper_id, time.time()))
+    attempts = [start_attempt(f"si_{i}", paper_id, connection) for i in range(writers)]
+    manager.close()
+    if legacy:
+        # WAL is a persistent property of the file, so switch the legacy database back
+        connection = sqlite3.connect(path)
+        connection.execute("PRAGMA journal_mode = DELETE")
+        connection.close()
+    return attempts
+
+def legacy_writer(path, attempt_id, rows):
+    connection = sqlite3.connect(path, timeout=30)
+    for row in rows_for(attempt_id, rows):
+        connection.executescript(SCHEMA)
+        connection.execute('''
+        INSERT OR IGNORE INTO responses (attempt_id, qno, stud_op, Score, Error_exp, Feedback)
+        VALUES (?, ?, ?, ?, ?, ?)''', row[:-1])
+        connection.commit()
+    connection.close()
+
+def batched_writer(manager, attempt_id, rows, batch_size):
+    with response_writer(manager=manager, batch_size=batch_size) as writer:
+        for row in rows_for(attempt_id, rows):
+            writer.add(row)
+    manager.close()
+
+def run(writers, target):
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(writers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+def count(path):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+    finally:
+        connection.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    print(f"{'rows':>6} {'writers':>8} {'legacy rows/s':>14} {'batched rows/s':>15} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in ROW_COUNTS:
+            for writers in WRITER_COUNTS:
+                legacy_path = os.path.join(tmp, f"legacy_{rows}_{writers}.db")
+                attempts = setup(legacy_path, writers, legacy=True)
+                legacy_s = run(writers, lambda i: legacy_writer(legacy_path, attempts[i], rows))
+
+                batched_path = os.path.join(tmp, f"batched_{rows}_{writers}.db")
+                attempts = setup(batched_path, writers)
+                manager = ConnectionManager(batched_path)
+                batched_s = run(writers, lambda i: batched_writer(manager, attempts[i], rows, args.batch_size))
+
+                total = rows * writers
+                assert count(legacy_path) == count(batched_path) == total, "row count mismatch"
+                print(f"{rows:>6} {writers:>8} {total / legacy_s:>14.0f} {total / batched_s:>15.0f} "
+                      f"{legacy_s / batched_s:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
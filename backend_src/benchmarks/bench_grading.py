@@ -0,0 +1,107 @@
+"""
+Benchmark: per-question grading vs the set-based calculate_score_and_generate_report.
+
+The legacy path runs one point query per answer and commits every report row on its
+own, as grading used to; the set-based path loads the paper once (cached), scores all
+answers in one pass and writes the report in one transaction. Both grade the same
+synthetic students against a scratch database, and the set-based path then re-grades
+them unchanged, which rewrites no rows. Run from backend_src:
+
+    python benchmarks/bench_grading.py
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database
+from database import INSERT_RESPONSE_SQL, analysis_writer, connect, response_row, save_analysis, save_questions, start_attempt
+from evaluate_student import calculate_score_and_generate_report
+from marking import option_number
+
+QUESTION_COUNTS = [30, 90, 300]
+
+def make_paper(paper_id, questions):
+    rows = [{"Question no": qno, "Question": f"Benchmark question {qno}?", "options": {1: "a", 2: "b", 3: "c", 4: "d"},
+             "Correct Answer": qno % 4 + 1} for qno in range(1, questions + 1)]
+    save_questions(paper_id, rows)
+    with analysis_writer() as writer:
+        for row in rows:
+            correct = row["Correct Answer"]
+            wrong = {str(n): {"Type_of_Error": "Conceptual Error", "Description": f"Option {n} is wrong."}
+                     for n in range(1, 5) if n != correct}
+            save_analysis(writer, paper_id, row["Question no"], {
+                "Difficulty": 2.5, "Subject": "Physics", "Topic": "Kinematics", "correct_option": str(correct),
+                "Correct_Answer_Explanation": "Because.", "Incorrect_Option_Analysis": wrong,
+                "Common_Student_Misconceptions": "NA", "Question_Type": "Conceptual", "Taxonomy": "Apply",
+                "Positive_Feedback": "Good.", "Negative_Feedback": "Revise."})
+
+def make_answers(questions, rng):
+    return {"answers": [{"Question no": qno, "option": rng.choice([1, 2, 3, 4, "Unattempted"])}
+                        for qno in range(1, questions + 1)]}
+
+def legacy_grade(qid, sid, student_answers):
+    """Per-answer point queries and per-row commits, with its own connection."""
+    connection = connect(database.db.path)
+    cursor = connection.cursor()
+    attempt_id = start_attempt(sid, qid, connection)
+    total_score = 0
+    for student_data in student_answers["answers"]:
+        cursor.execute('''
+        SELECT q.qno AS Qno, q.Question, q.op1, q.op2, q.op3, q.op4, q.correct_op, a.*
+        FROM questions q JOIN analyses a ON a.paper_id = q.paper_id AND a.qno = q.qno
+        WHERE q.paper_id = ? AND q.qno = ?''', (qid, student_data["Question no"]))
+        row = cursor.fetchone()
+        if row is None:
+            continue
+        explanation = dict(zip([column[0] for column in cursor.description], row))
+        chosen = option_number(student_data["option"])
+        score = 0 if chosen == 0 else (4 if chosen == option_number(explanation["correct_op"]) else -1)
+        total_score += score
+        data = {"Question Number": explanation["Qno"], "Student Option": f"Option{chosen}", "Score": score,
+                "Explanation for the option chosen": explanation["wrng_1"], "Negative Feedback": explanation["Negative_Feedback"]}
+        with connection:
+            connection.execute(INSERT_RESPONSE_SQL, (attempt_id, *response_row(data)))
+    connection.close()
+    return total_score
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=50, help="Students graded per paper size")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(f"{'questions':>9} {'legacy ms/student':>18} {'set-based ms/student':>21} {'regrade ms/student':>18} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        database.db.close()
+        database.db.path = os.path.join(tmp, "bench.db")
+        for questions in QUESTION_COUNTS:
+            paper_id = f"qp_bench_{questions}"
+            make_paper(paper_id, questions)
+            students = [make_answers(questions, rng) for _ in range(args.students)]
+
+            start = time.perf_counter()
+            legacy_totals = [legacy_grade(paper_id, f"si_legacy_{i}", answers) for i, answers in enumerate(students)]
+            legacy_s = time.perf_counter() - start
+
+            start = time.perf_counter()
+            totals = [calculate_score_and_generate_report(paper_id, f"si_set_{i}", answers)[-1]["Total Score"]
+                      for i, answers in enumerate(students)]
+            set_s = time.perf_counter() - start
+            assert legacy_totals == totals, "score mismatch"
+
+            # Re-grading unchanged answers finds every row's content hash unchanged and writes nothing
+            start = time.perf_counter()
+            for i, answers in enumerate(students):
+                calculate_score_and_generate_report(paper_id, f"si_set_{i}", answers)
+            regrade_s = time.perf_counter() - start
+
+            print(f"{questions:>9} {legacy_s * 1000 / args.students:>18.2f} {set_s * 1000 / args.students:>21.2f} "
+                  f"{regrade_s * 1000 / args.students:>18.2f} {legacy_s / set_s:>7.1f}x")
+        database.db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark: serial vs page-parallel answer sheet extraction.
+
+Run from backend_src:  python benchmarks/bench_read_pdf.py [--workers N]
+
+The parallel mode only pays off with more than one CPU: on a single core the pool
+adds process start-up and re-parsing on top of the same serial work, so expect a
+ratio at or below 1x there. Quote speedups from multi-core runs only.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import fitz
+import PyPDF2
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from io_operation import PDFProcessor
+
+PAGE_COUNTS = [10, 100, 1000]
+ANSWERS_PER_PAGE = 30
+
+def make_answer_sheet(path, pages):
+    """Writes a synthetic answer sheet with ANSWERS_PER_PAGE answers per page."""
+    doc = fitz.open()
+    qno = 1
+    for page_num in range(pages):
+        page = doc.new_page()
+        lines = ["Student ID: si_bench", "Question Paper ID: qp_bench"] if page_num == 0 else []
+        for _ in range(ANSWERS_PER_PAGE):
+            lines.append(f"{qno}. {'ABCD'[qno % 4]}")
+            qno += 1
+        page.insert_text((72, 72), "\n".join(lines), fontsize=9)
+    doc.save(path)
+    doc.close()
+
+def legacy_read_pdf(file_path):
+    """The original serial implementation, kept here as the baseline."""
+    text = ""
+    with open(file_path, "rb") as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        for page_num in range(len(pdf_reader.pages)):
+            page = pdf_reader.pages[page_num]
+            text += page.extract_text() + "\n"
+    return text
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=None, help="Pool size for the parallel mode (default: CPU count)")
+    args = parser.parse_args()
+
+    processor = PDFProcessor()
+    workers = args.workers or os.cpu_count() or 1
+    print(f"CPUs: {os.cpu_count()}, parallel workers: {workers}")
+    if (os.cpu_count() or 1) < 2:
+        print("Single CPU: the parallel column measures pool overhead, not a speedup")
+    print(f"{'pages':>6} {'legacy (s)':>11} {'serial (s)':>11} {'parallel (s)':>13} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for pages in PAGE_COUNTS:
+            path = os.path.join(tmp, f"sheet_{pages}.pdf")
+            make_answer_sheet(path, pages)
+
+            legacy_s, legacy_text = timed(legacy_read_pdf, path)
+            serial_s, serial_text = timed(processor.read_pdf, path)
+            parallel_s, parallel_text = timed(processor.read_pdf, path, parallel=True, workers=workers)
+            assert legacy_text == serial_text == parallel_text, "extraction mismatch"
+
+            print(f"{pages:>6} {legacy_s:>11.3f} {serial_s:>11.3f} {parallel_s:>13.3f} {legacy_s / parallel_s:>7.2f}x")
+
+if __name__ == "__main__":
+    main()
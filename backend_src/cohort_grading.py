@@ -0,0 +1,134 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+
+import numpy as np
+
+from evaluate_student import PaperKey, load_paper_key
+from io_operation import PDFProcessor
+from logger_config import logging
+from marking import UNATTEMPTED, MarkingScheme, difficulty_band, option_number
+
+BREAKDOWNS = ("Subject", "Topic", "Difficulty")
+# option_number for the values format_answers produces, looked up instead of parsed per answer
+OPTION_CODES_BY_ANSWER = {option: option_number(option) for option in (1, 2, 3, 4, "1", "2", "3", "4", "Unattempted")}
+
+def parse_answer_sheet(path):
+    """Parses one answer sheet into format_answers output. Runs inside a parsing worker process."""
+    processor = PDFProcessor()
+    sheet = processor.format_answers(processor.iter_pdf_pages(path, parallel=False))
+    sheet["file"] = os.path.basename(path)
+    return sheet
+
+def parse_answer_sheets(paths, workers=None):
+    """Parses many answer sheets in parallel. Returns (sheets, errors), sheets in input order."""
+    sheets, errors = [], []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(parse_answer_sheet, path) for path in paths]
+        for path, future in zip(paths, futures):
+            try:
+                sheets.append(future.result())
+            except Exception as e:
+                logging.error(f"Parsing failed for {path}: {e}")
+                errors.append({"file": os.path.basename(path), "error": str(e)})
+    return sheets, errors
+
+def answer_matrix(key: PaperKey, sheets: list) -> np.ndarray:
+    """
+    Packs answer sheets into a (students, questions) int8 matrix of option codes, with the
+    columns in the order of key.qnos. Questions a sheet does not mention are UNATTEMPTED;
+    answers to questions outside the key are dropped, and a repeated answer overrides the earlier one.
+    """
+    options = np.full((len(sheets), len(key)), UNATTEMPTED, dtype=np.int8)
+    answers = [answer for sheet in sheets for answer in sheet["answers"]]
+    if len(key) == 0 or not answers:
+        return options
+    # All sheets are flattened into one answer list, so the packing is a single scatter
+    rows = np.repeat(np.arange(len(sheets)), [len(sheet["answers"]) for sheet in sheets])
+    qnos = np.fromiter(map(itemgetter("Question no"), answers), dtype=np.int64, count=len(answers))
+    chosen = np.fromiter((OPTION_CODES_BY_ANSWER[option] if option in OPTION_CODES_BY_ANSWER else option_number(option)
+                          for option in map(itemgetter("option"), answers)), dtype=np.int8, count=len(answers))
+    positions = np.minimum(np.searchsorted(key.qnos, qnos), len(key) - 1)
+    found = key.qnos[positions] == qnos
+    options[rows[found], positions[found]] = chosen[found]
+    return options
+
+class CohortResult:
+    """
+    Scores of a whole cohort on one paper: the (students, questions) score matrix, per-student
+    totals and counts, and per-student totals for every Subject, Topic and Difficulty group.
+    """
+    def __init__(self, key: PaperKey, student_ids: list, options: np.ndarray, scheme: MarkingScheme):
+        self.paper_id = key.paper_id
+        self.student_ids = student_ids
+        self.scheme = scheme
+        marks = scheme.table(key.qnos, key.correct)
+        # One gather scores every answer of every student
+        self.scores = marks[np.arange(len(key))[None, :], options]
+        self.totals = self.scores.sum(axis=1)
+        self.max_total = marks.max(axis=1).sum().item()
+        attempted = options != UNATTEMPTED
+        self.attempted = attempted.sum(axis=1)
+        # Correct and wrong are attempted answers scoring above and below zero, as in
+        # summarize_report and the performance table
+        self.correct = (attempted & (self.scores > 0)).sum(axis=1)
+        self.wrong = (attempted & (self.scores < 0)).sum(axis=1)
+
+        labels = {
+            "Subject": [row["subject"] for row in key.rows],
+            "Topic": [row["topic"] for row in key.rows],
+            "Difficulty": [difficulty_band(row["diff"]) for row in key.rows],
+        }
+        self.breakdowns = {}
+        for dimension in BREAKDOWNS:
+            groups, inverse = np.unique(np.array(labels[dimension], dtype=str), return_inverse=True)
+            membership = np.zeros((len(key), len(groups)), dtype=marks.dtype)
+            membership[np.arange(len(key)), inverse] = 1
+            self.breakdowns[dimension] = (groups.tolist(), self.scores @ membership, marks.max(axis=1) @ membership)
+
+    def __len__(self):
+        return len(self.student_ids)
+
+    def student(self, i: int) -> dict:
+        return {
+            "Student ID": self.student_ids[i],
+            "Total Score": self.totals[i].item(),
+            "Attempted": self.attempted[i].item(),
+            "Correct": self.correct[i].item(),
+            "Wrong": self.wrong[i].item(),
+            **{dimension: dict(zip(groups, totals[i].tolist()))
+               for dimension, (groups, totals, _) in self.breakdowns.items()},
+        }
+
+    def students(self) -> list:
+        return [self.student(i) for i in range(len(self))]
+
+    def summary(self) -> dict:
+        """Cohort-wide statistics, with the mean score and the maximum marks of every breakdown group."""
+        def stats(values):
+            if len(values) == 0:
+                return {"mean": 0.0, "median": 0.0, "min": 0, "max": 0}
+            return {"mean": round(float(values.mean()), 3), "median": round(float(np.median(values)), 3),
+                    "min": values.min().item(), "max": values.max().item()}
+        return {
+            "Question Paper ID": self.paper_id,
+            "Students": len(self),
+            "Max Score": self.max_total,
+            "Total Score": stats(self.totals),
+            **{dimension: {group: {"mean": round(float(totals[:, g].mean()), 3) if len(self) else 0.0,
+                                   "max_marks": max_marks[g].item()}
+                           for g, group in enumerate(groups)}
+               for dimension, (groups, totals, max_marks) in self.breakdowns.items()},
+        }
+
+def grade_cohort(qid, sheets: list, scheme: MarkingScheme = None) -> CohortResult:
+    """
+    Grades parsed answer sheets (PDFProcessor.format_answers output, with integer question
+    numbers) for one paper in one vectorised pass. The paper must already be loaded and analysed; sheets for other papers
+    should be filtered out first.
+    """
+    key = load_paper_key(qid)
+    options = answer_matrix(key, sheets)
+    result = CohortResult(key, [sheet.get("Student ID") for sheet in sheets], options, scheme or MarkingScheme())
+    logging.info(f"Graded {len(result)} students on {len(key)} questions of {qid}")
+    return result
@@ -1,118 +1,493 @@
 #Quesation paper creation
+import hashlib
 import json
+import os
+import re
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 
 from logger_config import logging
+from marking import DIFFICULTY_BANDS, option_number
 
+DB_PATH = "Database/MindMark.db"
 
-def populate_q_db(question:list,id:str,connection,cursor):
-    cursor.execute(f'''
-    CREATE TABLE IF NOT EXISTS {id}_QP (
-    Qno INTEGER PRIMARY KEY,
+# One schema for every paper and student. Papers and students are rows, not tables or
+# files: questions and analyses are keyed by (paper_id, qno), and a student's answers
+# to a paper hang off one attempt row, found through (student_id, paper_id).
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS papers (
+    paper_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS questions (
+    paper_id TEXT NOT NULL REFERENCES papers(paper_id),
+    qno INTEGER NOT NULL,
     Question TEXT NOT NULL,
     op1 TEXT NOT NULL,
     op2 TEXT NOT NULL,
     op3 TEXT NOT NULL,
     op4 TEXT NOT NULL,
-    correct_op TEXT NOT NULL
-    );''')
-    connection.commit()
+    correct_op TEXT NOT NULL,
+    PRIMARY KEY (paper_id, qno)
+);
+CREATE TABLE IF NOT EXISTS analyses (
+    paper_id TEXT NOT NULL,
+    qno INTEGER NOT NULL,
+    diff REAL NOT NULL,
+    subject TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    corr_expl TEXT NOT NULL,
+    wrng_1 TEXT NOT NULL,
+    wrng_2 TEXT NOT NULL,
+    wrng_3 TEXT NOT NULL,
+    Common_Student_Misconceptions TEXT DEFAULT "NA",
+    Question_Type TEXT DEFAULT "NA",
+    Taxonomy TEXT DEFAULT "NA",
+    Positive_Feedback TEXT DEFAULT "NA",
+    Negative_Feedback TEXT DEFAULT "NA",
+    source TEXT NOT NULL DEFAULT 'gemini',
+    PRIMARY KEY (paper_id, qno),
+    FOREIGN KEY (paper_id, qno) REFERENCES questions(paper_id, qno)
+);
+CREATE TABLE IF NOT EXISTS students (
+    student_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS attempts (
+    attempt_id INTEGER PRIMARY KEY,
+    student_id TEXT NOT NULL REFERENCES students(student_id),
+    paper_id TEXT NOT NULL REFERENCES papers(paper_id),
+    graded_at REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS attempts_student_paper ON attempts(student_id, paper_id);
+CREATE INDEX IF NOT EXISTS attempts_paper ON attempts(paper_id);
+CREATE TABLE IF NOT EXISTS responses (
+    attempt_id INTEGER NOT NULL REFERENCES attempts(attempt_id),
+    qno INTEGER NOT NULL,
+    stud_op TEXT DEFAULT "NA",
+    Score INTEGER,
+    Error_exp TEXT DEFAULT "NA",
+    Feedback TEXT DEFAULT "NA",
+    content_hash TEXT,
+    PRIMARY KEY (attempt_id, qno)
+);
+'''
+
+# Every write to a paper's questions or analyses bumps papers.version, so cached copies of
+# a paper can be checked with one primary key lookup
+PAPER_VERSION_SCHEMA = "".join(f'''
+CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_version AFTER {event} ON {table} BEGIN
+    UPDATE papers SET version = version + 1 WHERE paper_id = {row}.paper_id;
+END;''' for table in ("questions", "analyses") for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")))
+
+# Per student x paper totals for the whole paper (dimension 'Total', group 'All') and for
+# every Subject, Topic, Difficulty band and Taxonomy group, so summaries are key lookups
+# rather than scans of responses. refresh_performance keeps an attempt's rows current.
+PERFORMANCE_DIMENSIONS = ("Total", "Subject", "Topic", "Difficulty", "Taxonomy")
+PERFORMANCE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS performance (
+    student_id TEXT NOT NULL,
+    paper_id TEXT NOT NULL,
+    dimension TEXT NOT NULL,
+    grp TEXT NOT NULL,
+    score REAL NOT NULL DEFAULT 0,
+    attempted INTEGER NOT NULL DEFAULT 0,
+    correct INTEGER NOT NULL DEFAULT 0,
+    wrong INTEGER NOT NULL DEFAULT 0,
+    questions INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (student_id, paper_id, dimension, grp)
+);
+'''
+_DIFFICULTY_BAND_SQL = "CASE " + " ".join(
+    f"WHEN a.diff <= {upper} THEN '{name}'" for name, upper in DIFFICULTY_BANDS if upper != float("inf")
+) + f" WHEN a.diff IS NOT NULL THEN '{DIFFICULTY_BANDS[-1][0]}' ELSE 'Unknown' END"
+# Aggregates every response row matching {where} into performance rows. Correct and wrong
+# follow summarize_report: attempted answers that scored above or below zero.
+_PERFORMANCE_INSERT_SQL = f'''
+INSERT INTO performance (student_id, paper_id, dimension, grp, score, attempted, correct, wrong, questions)
+SELECT student_id, paper_id, dimension, grp, SUM(score), SUM(attempted), SUM(correct), SUM(wrong), COUNT(*)
+FROM (
+    SELECT t.student_id, t.paper_id, d.dimension,
+           CASE d.dimension
+               WHEN 'Total' THEN 'All'
+               WHEN 'Subject' THEN COALESCE(a.subject, 'Unknown')
+               WHEN 'Topic' THEN COALESCE(a.topic, 'Unknown')
+               WHEN 'Difficulty' THEN {_DIFFICULTY_BAND_SQL}
+               ELSE COALESCE(a.Taxonomy, 'Unknown') END AS grp,
+           COALESCE(r.Score, 0) AS score,
+           r.stud_op != 'Unattempted' AS attempted,
+           r.stud_op != 'Unattempted' AND COALESCE(r.Score, 0) > 0 AS correct,
+           r.stud_op != 'Unattempted' AND COALESCE(r.Score, 0) < 0 AS wrong
+    FROM attempts t
+    JOIN responses r ON r.attempt_id = t.attempt_id
+    CROSS JOIN ({" UNION ALL ".join(f"SELECT '{name}' AS dimension" for name in PERFORMANCE_DIMENSIONS)}) d
+    LEFT JOIN analyses a ON a.paper_id = t.paper_id AND a.qno = r.qno
+    {{where}}
+)
+GROUP BY student_id, paper_id, dimension, grp'''
+
+# WAL lets readers run alongside the single writer, and with synchronous=NORMAL a
+# commit only appends to the WAL instead of fsyncing the database file.
+PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("foreign_keys", "ON"),
+    ("busy_timeout", 30000),
+    ("cache_size", -64 * 1024),         # KiB, i.e. 64 MiB of page cache per connection
+    ("mmap_size", 256 * 1024 * 1024),
+    ("temp_store", "MEMORY"),
+)
+WRITE_BATCH_SIZE = 64
+WRITE_BATCH_SECONDS = 1.0
+
+def connect(path: str = DB_PATH, schema: bool = True):
+    """Opens a new connection with PRAGMAS applied and, unless schema=False, the schema in place."""
+    connection = sqlite3.connect(path, timeout=30)
+    for name, value in PRAGMAS:
+        connection.execute(f"PRAGMA {name} = {value}")
+    if schema:
+        ensure_schema(connection)
+    return connection
+
+def ensure_schema(connection):
+    connection.executescript(SCHEMA)
+    if "content_hash" not in {column[1] for column in connection.execute("PRAGMA table_info(responses)")}:
+        # responses from before report rows were hashed; they are rewritten on the next grading
+        connection.execute("ALTER TABLE responses ADD COLUMN content_hash TEXT")
+    if "source" not in {column[1] for column in connection.execute("PRAGMA table_info(analyses)")}:
+        # Analyses from before provenance was recorded are taken to be Gemini's
+        connection.execute("ALTER TABLE analyses ADD COLUMN source TEXT NOT NULL DEFAULT 'gemini'")
+    if "version" not in {column[1] for column in connection.execute("PRAGMA table_info(papers)")}:
+        connection.execute("ALTER TABLE papers ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    connection.executescript(PAPER_VERSION_SCHEMA)
+    backfill = not table_exists(connection.cursor(), "performance")
+    connection.executescript(PERFORMANCE_SCHEMA)
+    if backfill:
+        # Databases with responses from before the performance table existed
+        rebuild_performance(connection)
+
+def rebuild_performance(connection):
+    """Recomputes the performance table from every response row."""
+    with connection:
+        connection.execute("DELETE FROM performance")
+        connection.execute(_PERFORMANCE_INSERT_SQL.format(where=""))
+
+def refresh_performance(connection, attempt_id: int):
+    """
+    Recomputes one attempt's performance rows from its responses. Call it inside the
+    transaction that writes the attempt's responses, so readers never see them disagree.
+    """
+    connection.execute('''
+    DELETE FROM performance WHERE (student_id, paper_id) = (SELECT student_id, paper_id FROM attempts WHERE attempt_id = ?)''',
+                       (attempt_id,))
+    connection.execute(_PERFORMANCE_INSERT_SQL.format(where="WHERE t.attempt_id = ?"), (attempt_id,))
+
+class ConnectionManager:
+    """
+    Hands out one connection per thread (and per process, since connections must not
+    cross a fork), so modules share tuned connections instead of opening their own.
+    The schema is created once per process, on the first connection.
+    """
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._schema_pid = None
+
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = connect(self.path, schema=False)
+            self.ensure_schema(connection)
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def ensure_schema(self, connection=None):
+        with self._lock:
+            if self._schema_pid == os.getpid():
+                return
+            ensure_schema(connection or self.connection())
+            self._schema_pid = os.getpid()
+
+    @contextmanager
+    def transaction(self):
+        """Runs the block in one write transaction on this thread's connection."""
+        connection = self.connection()
+        # Take the write lock up front rather than upgrading a read lock mid-transaction
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.rollback()
+            raise
+        connection.commit()
+
+    def close(self):
+        """Closes this thread's connection; the next call to connection() opens a fresh one."""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            self._local.connection = None
+            connection.close()
+
+db = ConnectionManager()
+
+class BatchWriter:
+    """
+    Buffers rows for one INSERT statement and writes them with executemany, in one
+    transaction per batch of batch_size rows or every interval seconds, whichever comes
+    first. Use as a context manager so the last partial batch is flushed. on_flush(rows),
+    if given, is called with each batch once its transaction has committed.
+    """
+    def __init__(self, sql: str, manager: ConnectionManager = None, batch_size: int = WRITE_BATCH_SIZE,
+                 interval: float = WRITE_BATCH_SECONDS, on_flush=None):
+        self.sql = sql
+        self.manager = manager or db
+        self.batch_size = batch_size
+        self.interval = interval
+        self.on_flush = on_flush
+        self.rows = []
+        self.written = 0
+        self._last_flush = time.monotonic()
+
+    def add(self, row: tuple):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size or time.monotonic() - self._last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            with self.manager.transaction() as connection:
+                connection.executemany(self.sql, self.rows)
+            self.written += len(self.rows)
+            rows, self.rows = self.rows, []
+            if self.on_flush:
+                self.on_flush(rows)
+        self._last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
+def table_exists(cursor, name: str) -> bool:
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,))
+    return cursor.fetchone() is not None
+
+def paper_exists(cursor, paper_id: str) -> bool:
+    cursor.execute("SELECT 1 FROM questions WHERE paper_id = ? LIMIT 1", (paper_id,))
+    return cursor.fetchone() is not None
+
+def question_row(question: dict) -> tuple:
     opts=question["options"]
     if opts=={}:
         opts={1:"NA",2:"NA",3:"NA",4:"NA"}
-    data = (
+    # Options are keyed by int when freshly extracted and by str once round-tripped through JSON
+    op1, op2, op3, op4 = (opts.get(i, opts.get(str(i), "NA")) for i in range(1, 5))
+    return (
         int(question["Question no"]),
         question["Question"],
-        opts[1],           
-        opts[2],      
-        opts[3],    
-        opts[4],
+        op1,
+        op2,
+        op3,
+        op4,
         question["Correct Answer"]
     )
-    cursor.execute(f'''
-    INSERT OR IGNORE INTO {id}_QP (Qno, Question, op1, op2, op3, op4, correct_op)
-    VALUES (?, ?, ?, ?, ?, ?, ?)''', data)
 
+def save_questions(paper_id: str, questions: list):
+    """Registers the paper and inserts all its questions in a single transaction."""
+    with db.transaction() as connection:
+        cursor = connection.cursor()
+        cursor.execute("INSERT OR IGNORE INTO papers (paper_id, created_at) VALUES (?, ?)", (paper_id, time.time()))
+        cursor.executemany('''
+        INSERT OR IGNORE INTO questions (paper_id, qno, Question, op1, op2, op3, op4, correct_op)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', [(paper_id, *question_row(question)) for question in questions])
+
+def load_questions(cursor, paper_id: str, qnos=None) -> list:
+    """Reads a paper's questions back into the dicts produced by merge_answers_with_questions."""
+    cursor.execute('''
+    SELECT qno, Question, op1, op2, op3, op4, correct_op FROM questions
+    WHERE paper_id = ? ORDER BY qno''', (paper_id,))
+    wanted = set(qnos) if qnos is not None else None
+    return [{"Question no": qno, "Question": question,
+             "options": {"1": op1, "2": op2, "3": op3, "4": op4}, "Correct Answer": correct_op}
+            for qno, question, op1, op2, op3, op4, correct_op in cursor.fetchall()
+            if wanted is None or qno in wanted]
 
 # #LLM Output Database
-def populate_analysis_db(connection,cursor, question,qno, id):
-    cursor.execute(f'''
-    CREATE TABLE IF NOT EXISTS {id}_LLM (
-            Qno INTEGER PRIMARY KEY,
-            diff TEXT NOT NULL,
-            subject TEXT NOT NULL,
-            topic TEXT NOT NULL,
-            corr_expl TEXT NOT NULL,
-            wrng_1 TEXT NOT NULL,
-            wrng_2 TEXT NOT NULL,
-            wrng_3 TEXT NOT NULL,
-            Common_Student_Misconceptions TEXT DEFAULT "NA",
-            Question_Type TEXT DEFAULT "NA",
-            Taxonomy TEXT DEFAULT "NA",
-            Positive_Feedback TEXT DEFAULT "NA",
-            Negative_Feedback TEXT DEFAULT "NA",
-            FOREIGN KEY (Qno) REFERENCES {id}_QP(Qno)
-    );''') 
-    connection.commit()
-    if "error" in question.keys():
-        return
-    opts = question["Options"]
-    if opts == {}:
-        opts = {"1": "NA", "2": "NA", "3": "NA", "4": "NA"}
-    print(question['Incorrect_Option_Analysis'].values())
-    wrng_1 = (list(question['Incorrect_Option_Analysis'].values())[0]["Type_of_Error"] +
-                " " + list(question['Incorrect_Option_Analysis'].values())[0]["Description"])
-    wrng_2 = (list(question['Incorrect_Option_Analysis'].values())[1]["Type_of_Error"] +
-                " " + list(question['Incorrect_Option_Analysis'].values())[1]["Description"])
-    try:
-        wrng_3 = (list(question['Incorrect_Option_Analysis'].values())[2]["Type_of_Error"] +
-                " " + list(question['Incorrect_Option_Analysis'].values())[2]["Description"])
-    except:
-        wrng_3="NA"
-    data = (
-        qno,
+ANALYSIS_COLUMNS = ("diff", "subject", "topic", "corr_expl", "wrng_1", "wrng_2", "wrng_3",
+                    "Common_Student_Misconceptions", "Question_Type", "Taxonomy",
+                    "Positive_Feedback", "Negative_Feedback")
+
+# Where an analysis row came from: all of it from Gemini, metadata from the local classifier
+# with explanations from Gemini, or copied from an identical question of another paper
+ANALYSIS_SOURCES = ("gemini", "classifier", "reused")
+
+def wrong_options(correct_option) -> list:
+    """The options stored in wrng_1..3, in order: every option except the correct one."""
+    correct = option_number(correct_option)
+    return [option for option in range(1, 5) if option != correct][:3]
+
+def analysis_row(question: dict) -> tuple:
+    """
+    Flattens an Explain dict into ANALYSIS_COLUMNS order. Incorrect_Option_Analysis is keyed
+    by option number ("2", "Option 2", ...), and each explanation goes into the wrng_ column
+    of its option (see wrong_options); options without one are stored as "NA".
+    """
+    by_option = {}
+    for option, w in question['Incorrect_Option_Analysis'].items():
+        digits = re.findall(r"\d+", str(option))
+        if digits:
+            by_option.setdefault(int(digits[0]), f'{w["Type_of_Error"]} {w["Description"]}')
+    wrng = [by_option.get(option, "NA") for option in wrong_options(question.get("correct_option"))]
+    return (
         question["Difficulty"],
         question["Subject"],
         question["Topic"],
-        wrng_1,
-        wrng_2,
-        wrng_3,
         question['Correct_Answer_Explanation'],
+        *wrng,
         question.get('Common_Student_Misconceptions', "NA"),
         question.get("Question_Type", "NA"),
         question.get("Taxonomy", "NA"),
         question.get("Positive_Feedback", "NA"),
         question.get("Negative_Feedback", "NA")
     )
-    print(data)
+
+def stored_explanation(row: dict) -> dict:
+    """
+    Rebuilds an Explain-shaped dict from a paper_analyses row, for showing analyses that are
+    already stored. Each wrong-option explanation comes back as one Description, since
+    analysis_row joins the error type and description into a single column.
+    """
+    wrong = {str(option): {"Type_of_Error": "", "Description": row[f"wrng_{slot}"]}
+             for slot, option in enumerate(wrong_options(row["correct_op"]), start=1) if row[f"wrng_{slot}"] != "NA"}
+    return {
+        "Question": row["Question"],
+        "Options": {"1": row["op1"], "2": row["op2"], "3": row["op3"], "4": row["op4"]},
+        "correct_option": str(row["correct_op"]),
+        "Subject": row["subject"],
+        "Topic": row["topic"],
+        "sub_topic": "NA",
+        "Difficulty": row["diff"],
+        "Correct_Answer_Explanation": row["corr_expl"],
+        "Incorrect_Option_Analysis": wrong,
+        "Common_Student_Misconceptions": row["Common_Student_Misconceptions"],
+        "Question_Type": row["Question_Type"],
+        "Taxonomy": row["Taxonomy"],
+        "Positive_Feedback": row["Positive_Feedback"],
+        "Negative_Feedback": row["Negative_Feedback"],
+        "source": row["source"],
+    }
+
+INSERT_ANALYSIS_SQL = f'''
+    INSERT OR IGNORE INTO analyses (paper_id, qno, {", ".join(ANALYSIS_COLUMNS)}, source)
+    VALUES (?, ?, {", ".join("?" * len(ANALYSIS_COLUMNS))}, ?)'''
+
+def analysis_writer(**kwargs) -> BatchWriter:
+    """A BatchWriter for (paper_id, qno, *analysis_row(question), source) rows."""
+    return BatchWriter(INSERT_ANALYSIS_SQL, **kwargs)
+
+def save_analysis(writer: BatchWriter, paper_id: str, qno: int, question: dict) -> bool:
+    """
+    Queues one question's analysis on writer; error results are skipped. The row's source is
+    question["source"] (see ANALYSIS_SOURCES), "gemini" by default. Returns whether a row was queued.
+    """
+    if "error" in question.keys():
+        return False
+    writer.add((paper_id, int(qno), *analysis_row(question), question.get("source", "gemini")))
+    return True
+
+def analysed_qnos(cursor, paper_id: str) -> set:
+    cursor.execute("SELECT qno FROM analyses WHERE paper_id = ?", (paper_id,))
+    return {row[0] for row in cursor.fetchall()}
+
+def missing_analyses(cursor, paper_id: str) -> list:
+    """Question numbers of a paper without an analysis row, i.e. never analysed or errored."""
+    cursor.execute('''
+    SELECT q.qno FROM questions q
+    LEFT JOIN analyses a ON a.paper_id = q.paper_id AND a.qno = q.qno
+    WHERE q.paper_id = ? AND a.qno IS NULL ORDER BY q.qno''', (paper_id,))
+    return [row[0] for row in cursor.fetchall()]
+
+def analysed_questions(cursor, exclude: str = None, source: str = None):
+    """
+    Every analysed question of every paper except `exclude`, optionally only those from
+    `source`, as (paper_id, qno, Question, op1, op2, op3, op4, correct_op, diff, subject,
+    topic, Taxonomy, Question_Type).
+    """
+    cursor.execute('''
+    SELECT q.paper_id, q.qno, q.Question, q.op1, q.op2, q.op3, q.op4, q.correct_op,
+           a.diff, a.subject, a.topic, a.Taxonomy, a.Question_Type
+    FROM questions q JOIN analyses a ON a.paper_id = q.paper_id AND a.qno = q.qno
+    WHERE q.paper_id IS NOT ? AND (? IS NULL OR a.source = ?)''', (exclude, source, source))
+    return cursor.fetchall()
+
+def analysed_questions_after(cursor, rowid: int = 0):
+    """
+    Questions whose analysis row was written after analyses row `rowid`, as (rowid,
+    paper_id, qno, Question, op1, op2, op3, op4, correct_op) in write order. Analyses
+    are insert-only, so this is exactly what an index built up to `rowid` is missing.
+    """
+    cursor.execute('''
+    SELECT a.rowid, q.paper_id, q.qno, q.Question, q.op1, q.op2, q.op3, q.op4, q.correct_op
+    FROM analyses a JOIN questions q ON q.paper_id = a.paper_id AND q.qno = a.qno
+    WHERE a.rowid > ?
+    ORDER BY a.rowid''', (rowid,))
+    return cursor.fetchall()
+
+def analysis_count(cursor, source: str = None) -> int:
+    """Number of analysis rows, optionally only those from `source`."""
+    cursor.execute("SELECT COUNT(*) FROM analyses WHERE ? IS NULL OR source = ?", (source, source))
+    return cursor.fetchone()[0]
+
+def copy_analysis(cursor, src_id: str, src_qno: int, dst_id: str, dst_qno: int):
+    """Copies one question's analysis between papers, marking the copy as reused."""
+    columns = ", ".join(ANALYSIS_COLUMNS)
     cursor.execute(f'''
-    INSERT OR IGNORE INTO {id}_LLM (Qno, diff, subject, topic, wrng_1, wrng_2, wrng_3, corr_expl,
-                            Common_Student_Misconceptions, Question_Type, Taxonomy,
-                            Positive_Feedback, Negative_Feedback)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', data)
-    connection.commit()
-    return {}
+    INSERT OR IGNORE INTO analyses (paper_id, qno, {columns}, source)
+    SELECT ?, ?, {columns}, 'reused' FROM analyses WHERE paper_id = ? AND qno = ?''', (dst_id, dst_qno, src_id, src_qno))
+
+def paper_analyses(cursor, paper_id: str) -> list:
+    """Every analysed question of a paper joined with its analysis, as dicts ordered by question number."""
+    cursor.execute('''
+    SELECT q.qno AS Qno, q.Question, q.op1, q.op2, q.op3, q.op4, q.correct_op, a.*
+    FROM questions q JOIN analyses a ON a.paper_id = q.paper_id AND a.qno = q.qno
+    WHERE q.paper_id = ?
+    ORDER BY q.qno''', (paper_id,))
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+def paper_version(cursor, paper_id: str):
+    """The paper's version, which changes whenever its questions or analyses do; None for an unknown paper."""
+    cursor.execute("SELECT version FROM papers WHERE paper_id = ?", (paper_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
 
 #evaluation report of students
-def populate_report_db(connection,cursor,question: list,qp_id:str):
-    cursor.execute(f'''
-        CREATE TABLE IF NOT EXISTS {qp_id} (
-            Qno INTEGER PRIMARY KEY,
-            Question TEXT NOT NULL,
-            Score INTEGER,
-            subject TEXT NOT NULL,
-            topic TEXT NOT NULL,
-            diff INTEGER DEFAULT 0,
-            Taxonomy TEXT DEFAULT "NA",
-            stud_op TEXT DEFAULT "NA",
-            Error_exp TEXT DEFAULT "NA",
-            Common_Student_Misconceptions TEXT NOT NULL,
-            Feedback TEXT DEFAULT "NA"
-        )''')
-    connection.commit()
-
-    if "Total Score" in question.keys():
-        return 
+def _upsert_attempt(connection, student_id: str, paper_id: str) -> int:
+    now = time.time()
+    connection.execute("INSERT OR IGNORE INTO students (student_id, created_at) VALUES (?, ?)", (student_id, now))
+    connection.execute('''
+    INSERT INTO attempts (student_id, paper_id, graded_at) VALUES (?, ?, ?)
+    ON CONFLICT (student_id, paper_id) DO UPDATE SET graded_at = excluded.graded_at''', (student_id, paper_id, now))
+    cursor = connection.execute("SELECT attempt_id FROM attempts WHERE student_id = ? AND paper_id = ?", (student_id, paper_id))
+    return cursor.fetchone()[0]
+
+def start_attempt(student_id: str, paper_id: str, connection=None) -> int:
+    """Returns the attempt_id of a student's attempt at a paper, creating the student and attempt if needed."""
+    connection = connection or db.connection()
+    with connection:
+        return _upsert_attempt(connection, student_id, paper_id)
+
+def response_hash(values: tuple) -> str:
+    """Digest of a response row's graded content, used to skip rewriting unchanged rows."""
+    return hashlib.blake2b(json.dumps(values, ensure_ascii=False).encode("utf-8"), digest_size=16).hexdigest()
+
+def response_row(question: dict) -> tuple:
+    """The student-specific part of a report row: (qno, stud_op, Score, Error_exp, Feedback, content_hash)."""
     expl = ""
     if isinstance(question.get("Explanation for the option chosen"), dict):
         expl = (
@@ -122,27 +497,83 @@ def populate_report_db(connection,cursor,question: list,qp_id:str):
     else:
         expl = question.get("Explanation for the option chosen", "NA")
     feedback = question.get("Positive Feedback", question.get("Negative Feedback", "NA"))
-    data=(
-        int(question["Question Number"]),
-        question["Question"],
-        question.get("Score", None),
-        question["Subject"],
-        question["Topic"],
-        int(question["Difficulty"]),
-        question.get("Taxonomy", "NA"),
+    content = (
         question.get("Student Option", "NA"),
+        question.get("Score", None),
         expl,
-        question.get("Common Misconceptions", "NA"),
         feedback
     )
-    cursor.execute(f'''
-        INSERT OR IGNORE INTO {qp_id} (
-            Qno, Question, Score, subject, topic, diff, Taxonomy, 
-            stud_op, Error_exp, Common_Student_Misconceptions, Feedback
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', data)
-    connection.commit()
-    logging.info("Question Paper data updated in DB")
-    return {}
+    return (int(question["Question Number"]), *content, response_hash(content))
+
+# Rows whose content hash is unchanged are left untouched rather than rewritten
+INSERT_RESPONSE_SQL = '''
+    INSERT INTO responses (attempt_id, qno, stud_op, Score, Error_exp, Feedback, content_hash)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (attempt_id, qno) DO UPDATE SET
+        stud_op = excluded.stud_op,
+        Score = excluded.Score,
+        Error_exp = excluded.Error_exp,
+        Feedback = excluded.Feedback,
+        content_hash = excluded.content_hash
+    WHERE responses.content_hash IS NOT excluded.content_hash'''
+
+def response_writer(**kwargs) -> BatchWriter:
+    """A BatchWriter for (attempt_id, *response_row(question)) rows."""
+    return BatchWriter(INSERT_RESPONSE_SQL, **kwargs)
+
+def save_report(student_id: str, paper_id: str, report: list) -> dict:
+    """
+    Records a student's report for a paper in one transaction, replacing any earlier grading.
+    Only rows whose content hash changed are written, rows for questions no longer in the
+    report are deleted, and the performance aggregates are refreshed only if anything changed.
+    Returns the attempt_id and the number of rows written, unchanged and deleted.
+    """
+    rows = {}
+    for question in report:
+        if "Total Score" not in question:
+            row = response_row(question)
+            rows[row[0]] = row
+    with db.transaction() as connection:
+        attempt_id = _upsert_attempt(connection, student_id, paper_id)
+        stored = dict(connection.execute("SELECT qno, content_hash FROM responses WHERE attempt_id = ?", (attempt_id,)))
+        changed = [(attempt_id, *row) for qno, row in rows.items() if stored.get(qno) != row[-1]]
+        stale = [(attempt_id, qno) for qno in stored if qno not in rows]
+        connection.executemany(INSERT_RESPONSE_SQL, changed)
+        connection.executemany("DELETE FROM responses WHERE attempt_id = ? AND qno = ?", stale)
+        if changed or stale:
+            refresh_performance(connection, attempt_id)
+    counts = {"attempt_id": attempt_id, "written": len(changed), "unchanged": len(rows) - len(changed), "deleted": len(stale)}
+    logging.debug(f"Saved report of {student_id} for {paper_id}: {counts}")
+    return counts
 
+def load_report(cursor, student_id: str, paper_id: str) -> list:
+    """A student's graded rows for a paper, with question and analysis columns joined in."""
+    cursor.execute('''
+    SELECT r.qno AS Qno, q.Question, r.Score, a.subject, a.topic, a.diff, a.Taxonomy, r.stud_op,
+           r.Error_exp, a.Common_Student_Misconceptions, r.Feedback
+    FROM attempts t
+    JOIN responses r ON r.attempt_id = t.attempt_id
+    JOIN questions q ON q.paper_id = t.paper_id AND q.qno = r.qno
+    LEFT JOIN analyses a ON a.paper_id = t.paper_id AND a.qno = r.qno
+    WHERE t.student_id = ? AND t.paper_id = ? ORDER BY r.qno''', (student_id, paper_id))
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
 
+def student_performance(cursor, student_id: str, paper_id: str = None, dimension: str = None) -> dict:
+    """
+    A student's aggregates from the performance table as {paper_id: {dimension: {group: totals}}},
+    optionally limited to one paper and/or dimension. Reads only the student's own rows.
+    """
+    query = "SELECT paper_id, dimension, grp, score, attempted, correct, wrong, questions FROM performance WHERE student_id = ?"
+    params = [student_id]
+    if paper_id is not None:
+        query += " AND paper_id = ?"
+        params.append(paper_id)
+    if dimension is not None:
+        query += " AND dimension = ?"
+        params.append(dimension)
+    performance = {}
+    for paper, dim, group, score, attempted, correct, wrong, questions in cursor.execute(query, params):
+        performance.setdefault(paper, {}).setdefault(dim, {})[group] = {
+            "score": score, "attempted": attempted, "correct": correct, "wrong": wrong, "questions": questions}
+    return performance
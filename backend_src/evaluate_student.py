@@ -1,7 +1,14 @@
 import json
-import sqlite3
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from database import populate_report_db
+import numpy as np
+
+from database import db, paper_analyses, paper_version, save_report
+from marking import INVALID_OPTION, UNATTEMPTED, MarkingScheme, option_number
+from io_operation import PDFProcessor
+from logger_config import logging
 
 def load_json(file_path):
     """Loads JSON data from a file."""
@@ -92,55 +99,86 @@ def load_json(file_path):
 
 #     return results
 
-def calculate_score_and_generate_report(qid,sid, student_answers):
-    """Calculates the score and generates a report for students."""
+class PaperKey:
+    """A paper's analysed questions, with question numbers and correct options as arrays for grading."""
+    def __init__(self, paper_id, rows, version=None):
+        self.paper_id = paper_id
+        self.rows = rows
+        self.version = version
+        self.qnos = np.array([row["Qno"] for row in rows], dtype=np.int64)
+        self.correct = np.array([option_number(row["correct_op"]) for row in rows], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.rows)
+
+_paper_keys = {}
+_paper_keys_lock = threading.Lock()
+
+def load_paper_key(qid) -> PaperKey:
+    """
+    Loads the paper's joined question and analysis rows with one query and caches them
+    per process. The cache is refreshed whenever the paper's questions or analyses change
+    (see paper_version).
+    """
+    cursor = db.connection().cursor()
+    version = paper_version(cursor, qid)
+    with _paper_keys_lock:
+        key = _paper_keys.get(qid)
+    if key is None or version is None or key.version != version:
+        key = PaperKey(qid, paper_analyses(cursor, qid), version)
+        with _paper_keys_lock:
+            _paper_keys[qid] = key
+    return key
+
+def score_answers(key: PaperKey, answers: list, scheme: MarkingScheme = None):
+    """
+    Scores a student's answers against a paper in one pass, with the default marking scheme
+    unless one is given. Answers to questions without an analysis are dropped.
+    Returns (row positions in key, chosen options, correct mask, scores).
+    """
+    qnos = np.array([int(answer.get("Question no", -1)) for answer in answers], dtype=np.int64)
+    chosen = np.array([option_number(answer["option"]) for answer in answers], dtype=np.int64)
+    if len(key) == 0 or len(qnos) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0, dtype=bool), empty
+
+    positions = np.minimum(np.searchsorted(key.qnos, qnos), len(key) - 1)
+    found = key.qnos[positions] == qnos
+    positions, chosen = positions[found], chosen[found]
+    is_correct = (chosen == key.correct[positions]) & (chosen != INVALID_OPTION)
+    scores = (scheme or MarkingScheme()).table(key.qnos, key.correct)[positions, chosen]
+    return positions, chosen, is_correct, scores
+
+def calculate_score_and_generate_report(qid,sid, student_answers, on_row=None, scheme: MarkingScheme = None):
+    """
+    Calculates the score and generates a report for students.
+    on_row(row) is called with each graded row once the report is written. The sheet is
+    scored in one pass and saved in one transaction, so rows are reported per sheet: all of
+    them together, right after the save.
+    """
+    key = load_paper_key(qid)
+    positions, chosen, is_correct, scores = score_answers(key, student_answers['answers'], scheme)
+    # wrng_1..3 hold the incorrect options in option order, skipping the correct one (see wrong_options)
+    correct_options = key.correct[positions]
+    wrong_index = chosen - 1 - ((chosen > correct_options) & (correct_options >= 1) & (correct_options <= 4))
 
-    read_connection = sqlite3.connect(f"Database/Questions.db")
-    read_connection.row_factory = sqlite3.Row 
-    cursor = read_connection.cursor()
-    write_conn=sqlite3.connect(f"Database/{sid}.db")
-    write_cursor=write_conn.cursor()
     results = []
-    total_score = 0
-    query_LLM = f"SELECT * FROM {qid}_LLM WHERE Qno = ?"
-    query_QP=f"SELECT * FROM {qid}_QP WHERE Qno = ?"
-    # Iterate through student answers
-    data={}
-    for student_data in student_answers['answers']:
-        question_no = int(student_data.get("Question no", -1))  # Extract question number
-        student_option = f"Option{student_data['option']}" if student_data["option"] != "Unattempted" else "Unattempted"
-        
-        # Retrieve explanation data for the current question
-        cursor.execute(query_LLM, (question_no,))
-        exp = cursor.fetchone()
-        if exp==None:
-            continue
-        explanation=dict(exp)
-        cursor.execute(query_QP, (question_no,))
-        exp = cursor.fetchone()
-        explanation.update(dict(exp))
-        print(explanation)
+    for position, option, correct, score, wrong in zip(positions.tolist(), chosen.tolist(), is_correct.tolist(),
+                                                        scores.tolist(), wrong_index.tolist()):
+        explanation = key.rows[position]
+        question_no = explanation["Qno"]
+        student_option = "Unattempted" if option == UNATTEMPTED else f"Option{option}"
 
         # Extract necessary details
         question_text = explanation.get("Question", "No question available.")
         subject = explanation.get("subject", "Unknown")
         topic = explanation.get("topic", "Unknown")
-        difficulty = explanation.get("Difficulty", 2.5)
+        difficulty = explanation.get("diff", 2.5)
         taxonomy = explanation.get("Taxonomy", "Unknown")
-        correct_option = f"Option{explanation.get('correct_option', 'Unattempted')}"
-
-        # Check if the student's choice is correct
-        if student_option != "Unattempted":
-            is_correct = student_option == correct_option
-            score = 4 if is_correct else -1
-        else:
-            is_correct = False
-            score = 0
-
-        total_score += score
+        correct_option = f"Option{explanation.get('correct_op', 'Unattempted')}"
 
         # Generate explanation based on correctness
-        if is_correct:            
+        if correct:
             explanation_text = explanation.get("corr_expl", "No explanation available.")
             positive_highlights = explanation.get("Positive_Feedback", "No highlights available.")
             positive_feedback = f"Great job! {positive_highlights} Keep up the good work!"
@@ -160,10 +198,10 @@ def calculate_score_and_generate_report(qid,sid, student_answers):
                 "Positive Feedback": positive_feedback
             }
         else:
-            explanation_text = explanation.get("Incorrect_Option_Analysis", {}).get(
-                student_option[-1] if student_option != "Unattempted" else "Unattempted",
-                "No explanation available.")
-            
+            explanation_text = "No explanation available."
+            if 1 <= option <= 4 and 0 <= wrong < 3 and explanation.get(f"wrng_{wrong + 1}", "NA") != "NA":
+                explanation_text = explanation[f"wrng_{wrong + 1}"]
+
             misconceptions = explanation.get("Common_Student_Misconceptions", "No misconceptions available.")
             negative_feedback = explanation.get("Negative_Feedback", "No feedback available.")
             
@@ -184,18 +222,69 @@ def calculate_score_and_generate_report(qid,sid, student_answers):
                 "Common Misconceptions": misconceptions,
                 "Negative Feedback": negative_feedback,
             }
-        
-        populate_report_db(write_conn,write_cursor,data,qid)
-        write_conn.commit()
         results.append(data)
 
+    save_report(sid, qid, results)
+    # Rows are only reported once they are stored, which happens for the whole sheet at once
+    if on_row:
+        for data in results:
+            on_row(data)
+
     # Append total score
-    results.append({"Total Score": total_score})
-    write_conn.commit()
-    write_conn.close()
-    read_connection.close()
+    results.append({"Total Score": scores.sum().item()})
     return results
 
+def summarize_report(results):
+    """Condenses a report from calculate_score_and_generate_report into per-student counts."""
+    rows = [row for row in results if "Total Score" not in row]
+    attempted = [row for row in rows if row["Student Option"] != "Unattempted"]
+    return {
+        "Total Score": results[-1]["Total Score"] if results else 0,
+        "Questions": len(rows),
+        "Attempted": len(attempted),
+        "Correct": sum(1 for row in attempted if row["Score"] > 0),
+        "Wrong": sum(1 for row in attempted if row["Score"] < 0),
+    }
+
+def grade_answer_sheet(path, qid=None):
+    """Parses and grades a single answer sheet. Runs inside a grading worker process."""
+    processor = PDFProcessor()
+    student_answers = processor.format_answers(processor.iter_pdf_pages(path, parallel=False))
+    sid = student_answers["Student ID"]
+    sheet_qid = student_answers["Question Paper ID"]
+    summary = {"file": os.path.basename(path), "Student ID": sid, "Question Paper ID": sheet_qid}
+    if sid is None:
+        summary["error"] = "Student ID not found on answer sheet"
+        return summary
+    if qid is not None and sheet_qid != qid:
+        summary["error"] = f"Answer sheet is for question paper {sheet_qid}, expected {qid}"
+        return summary
+
+    results = calculate_score_and_generate_report(sheet_qid, sid, student_answers=student_answers)
+    save_json(results, f"{processor.outpath}/{sid}/eval_report_{sheet_qid}.json")
+    summary.update(summarize_report(results))
+    return summary
+
+def grade_answer_sheets(paths, qid=None, workers=None, on_summary=None):
+    """
+    Grades many answer sheets for one question paper in parallel.
+    The paper must already be loaded and analysed. Returns one summary per sheet, in input order.
+    on_summary(done, summary) is called as each sheet finishes, in completion order.
+    """
+    summaries = [None] * len(paths)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(grade_answer_sheet, path, qid): i for i, path in enumerate(paths)}
+        for done, future in enumerate(as_completed(futures), 1):
+            i = futures[future]
+            try:
+                summaries[i] = future.result()
+            except Exception as e:
+                logging.error(f"Grading failed for {paths[i]}: {e}")
+                summaries[i] = {"file": os.path.basename(paths[i]), "error": str(e)}
+            if on_summary is not None:
+                on_summary(done, summaries[i])
+    return summaries
+
 def save_json(data, output_file):
     """Saves JSON data to a file."""
     with open(output_file, 'w') as f:
@@ -1,19 +1,97 @@
 import json
 import os
-import sqlite3
+import random
+import re
 import sys
+import threading
 import time
 import logging
-from typing import Any, Dict, List, Union
-from database import populate_analysis_db
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Union
+from analysis_log import AnalysisLog, compact, log_path_for
+from database import analysis_writer, db, load_questions, missing_analyses, paper_analyses, save_analysis, stored_explanation
+from json_repair import repair_json
+from llm_cache import LLMResponseCache, get_response_cache
+from llm_metrics import LLMMetrics, metrics as process_metrics
+from metadata_classifier import MetadataClassifier, trained_classifier
 from utils.get_keys import load_config
 import sys
 import google.generativeai as genai
+from google.ai import generativelanguage as glm
 from google.api_core import exceptions as genai_exceptions
 from langchain_core.pydantic_v1 import BaseModel, Field
 
 load_config("../configs/config.yaml")
 
+# Overridable from configs/config.yaml, which load_config exports to the environment
+DEFAULT_CONCURRENCY = int(os.environ.get("GEMINI_CONCURRENCY", 8))
+# Request and token budgets are per API key
+DEFAULT_REQUESTS_PER_MINUTE = float(os.environ.get("GEMINI_REQUESTS_PER_MINUTE", 60))
+DEFAULT_TOKENS_PER_MINUTE = float(os.environ.get("GEMINI_TOKENS_PER_MINUTE", 1000000))
+BASE_COOLDOWN_SECONDS = 2.0
+MAX_COOLDOWN_SECONDS = 120.0
+# Quota errors a request may hit before its questions are given up on; they are left
+# without an analysis row, so repair_analyses picks them up later
+MAX_QUOTA_RETRIES = int(os.environ.get("GEMINI_MAX_QUOTA_RETRIES", 8))
+QUOTA_ERROR = "API quota exhausted after repeated retries."
+# A batch shares one max_output_tokens budget, so keep it to a handful of questions
+DEFAULT_BATCH_SIZE = int(os.environ.get("GEMINI_BATCH_SIZE", 1))
+# "local" fills subject, topic, difficulty, taxonomy and question type from a classifier trained
+# on earlier analyses, so Gemini only writes the explanations; "off" sends everything to Gemini
+METADATA_TIER = os.environ.get("GEMINI_METADATA_TIER", "local")
+EXPLANATION_MAX_OUTPUT_TOKENS = int(os.environ.get("GEMINI_EXPLANATION_MAX_OUTPUT_TOKENS", 2048))
+
+EXPLANATION_PROMPT = """
+You are an AI Evaluation Assistant designed to analyze and evaluate questions, providing structured and comprehensive feedback.
+
+Question: {question}
+Options: {options}
+Correct Answer: {correct_option}
+Subject: {subject}, Topic: {topic}
+
+Provide explanations in the following JSON format:
+{{
+    "Correct_Answer_Explanation": "Concise explanation of the correct answer.",
+    "Incorrect_Option_Analysis": {{
+        "Option_Number": {{
+            "Type_of_Error": "Specify the type of error (e.g., Conceptual Error, Calculative Error, etc.)",
+            "Description": "Explain in one or two sentences why this option is incorrect."
+        }}
+    }},
+    "Common_Student_Misconceptions": "List common misconceptions that students might have while answering this question.",
+    "Positive_Feedback": "Feedback on the student's strengths in the key concepts of the question, in 2-3 sentences.",
+    "Negative_Feedback": "Feedback on the student's misunderstanding of the key concepts and where to improve, in 2-3 sentences."
+}}
+"""
+
+BATCH_PROMPT = """
+You are an AI Evaluation Assistant designed to analyze and evaluate questions, providing structured and comprehensive feedback.
+
+Analyse each of the questions below. Respond with a JSON array holding one object per question, in the same order, each in this format:
+{{
+    "Question_no": "Question number exactly as given",
+    "Subject": "Subject name",
+    "Topic": "Topic name",
+    "sub_topic": "Sub_topic name according to subject and topic",
+    "Taxonomy": "Cognitive level (e.g., Knowledge, Application, Analysis).",
+    "Question_Type": "Type of question (e.g., Calculative, Conceptual, Application-Based).",
+    "Correct_Answer_Explanation": "Detailed explanation of the correct answer.",
+    "Incorrect_Option_Analysis": {{
+        "Option_Number": {{
+            "Type_of_Error": "Specify the type of error (e.g., Conceptual Error, Calculative Error, etc.)",
+            "Description": "Explain why this option is incorrect and contrast it with the correct answer."
+        }}
+    }},
+    "Common_Student_Misconceptions": "List common misconceptions that students might have while answering this question.",
+    "Difficulty": "Rate the difficulty on a scale of 0 to 5.",
+    "Positive_Feedback": "Provide detailed feedback, focusing on the student's strengths in understanding the key concepts and the topic of the question. Highlight their ability to apply these concepts effectively in 2-3 sentences.",
+    "Negative_Feedback": "Provide negative feedback but detailed feedback, focusing on the student's misunderstanding of the key concepts and the topic. Identify the exact areas where they need improvement and offer a clear review in 2-3 sentences."
+}}
+
+Questions:
+{questions}
+"""
+
 class Explain(BaseModel):
     Question: str = Field(description="Question")
     Subject: str = Field(description="Subject name")
@@ -30,35 +108,193 @@ class Explain(BaseModel):
     correct_option: str = Field(description="correct_option")
     Options: dict = Field(description="Options")
 
+# Explain fields the model may leave out without making the analysis useless
+OPTIONAL_FIELDS = ("sub_topic", "Common_Student_Misconceptions", "Question_Type", "Taxonomy",
+                   "Positive_Feedback", "Negative_Feedback")
+
+def salvage_explanation(item: Dict[str, Any], question: str, options: Dict[str, str], correct_option) -> Dict[str, Any]:
+    """
+    Validates a parsed model response field by field instead of all-or-nothing.
+
+    The question, options and correct option are filled in locally, optional fields
+    default to "NA", a difficulty such as "3/5" is reduced to its number, and the
+    incorrect option analysis is normalised to the shape analysis_row reads.
+    Raises ValueError only when Subject, Topic, the correct answer explanation or a
+    numeric difficulty is missing.
+    """
+    if not isinstance(item, dict):
+        raise ValueError(f"Expected a JSON object, got {type(item).__name__}")
+    item = dict(item, Question=question, Options=options, correct_option=str(correct_option))
+    for field in OPTIONAL_FIELDS:
+        if not isinstance(item.get(field), str) or not item[field].strip():
+            item[field] = "NA"
+
+    difficulty = re.search(r"\d+(\.\d+)?", str(item.get("Difficulty", "")))
+    if difficulty is None:
+        raise ValueError(f"No numeric Difficulty in {item.get('Difficulty')!r}")
+    item["Difficulty"] = float(difficulty.group())
+
+    analysis = item.get("Incorrect_Option_Analysis")
+    analysis = analysis if isinstance(analysis, dict) else {}
+    for option, detail in analysis.items():
+        if not isinstance(detail, dict):
+            detail = {"Description": str(detail)}
+        analysis[option] = {"Type_of_Error": str(detail.get("Type_of_Error", "NA")),
+                            "Description": str(detail.get("Description", "NA"))}
+    item["Incorrect_Option_Analysis"] = analysis
+
+    return Explain(**item).dict()
+
+class TokenBucket:
+    """
+    Token bucket refilling at `rate` tokens per second up to `capacity`.
+    Not locked itself; APIKeyManager guards its buckets with the pool lock.
+    """
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, tokens: float, now: float) -> float:
+        """Seconds until `tokens` can be taken; 0 if they are available now."""
+        self._refill(now)
+        tokens = min(tokens, self.capacity)
+        return 0.0 if self.tokens >= tokens else (tokens - self.tokens) / self.rate
+
+    def consume(self, tokens: float):
+        # May go negative when actual usage exceeds the estimate; later callers then wait it off
+        self.tokens -= tokens
+
+class KeyState:
+    def __init__(self, index: int, requests_per_minute: float, tokens_per_minute: float):
+        self.index = index
+        self.requests = TokenBucket(rate=requests_per_minute / 60, capacity=requests_per_minute)
+        self.tokens = TokenBucket(rate=tokens_per_minute / 60, capacity=tokens_per_minute)
+        self.cooldown_until = 0.0
+        self.failures = 0
+        self.last_used = 0.0
+
 class APIKeyManager:
-    def __init__(self, api_keys: List[str]):
+    """
+    Schedules requests over a pool of API keys.
+
+    Each key has its own requests- and tokens-per-minute budget. acquire() hands out
+    the least recently used key with budget left, so every healthy key is used at
+    once. A key that hits ResourceExhausted is put on a cooldown that doubles with
+    each consecutive failure (with jitter) while the other keys keep serving.
+    """
+    def __init__(self, api_keys: List[str], requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = DEFAULT_TOKENS_PER_MINUTE,
+                 base_cooldown: float = BASE_COOLDOWN_SECONDS, max_cooldown: float = MAX_COOLDOWN_SECONDS):
+        api_keys = [key for key in api_keys if key]
         if not api_keys:
             logging.error("No API keys provided.")
             sys.exit(1)
         self.api_keys = api_keys
         self.total_keys = len(api_keys)
-        self.current_index = 0
+        self.requests_per_minute = requests_per_minute
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.states = [KeyState(i, requests_per_minute, tokens_per_minute) for i in range(self.total_keys)]
+        self._lock = threading.Lock()
+        logging.info(f"Loaded {self.total_keys} API keys ({requests_per_minute:g} RPM, {tokens_per_minute:g} TPM each)")
 
-    def get_current_key(self) -> str:
-        return self.api_keys[self.current_index]
+    def acquire(self, estimated_tokens: int = 0) -> int:
+        """Blocks until a key has budget for one request of ~estimated_tokens and returns its index."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                best_wait = None
+                for state in sorted(self.states, key=lambda st: st.last_used):
+                    wait = max(state.cooldown_until - now,
+                               state.requests.wait_time(1, now),
+                               state.tokens.wait_time(estimated_tokens, now))
+                    if wait <= 0:
+                        state.requests.consume(1)
+                        state.tokens.consume(estimated_tokens)
+                        state.last_used = now
+                        return state.index
+                    best_wait = wait if best_wait is None else min(best_wait, wait)
+            time.sleep(best_wait)
 
-    def switch_key(self) -> bool:
-        """
-        Switch to the next API key.
-        Returns True if switched successfully, False if all keys have been tried.
-        """
-        self.current_index += 1
-        if self.current_index >= self.total_keys:
-            self.current_index = 0
-            return False  # All keys have been cycled through
-        return True
+    def report_success(self, index: int, extra_tokens: int = 0):
+        """Clears the key's failure streak and charges tokens used beyond the estimate."""
+        with self._lock:
+            state = self.states[index]
+            state.failures = 0
+            state.tokens.consume(extra_tokens)
+
+    def report_exhausted(self, index: int):
+        with self._lock:
+            state = self.states[index]
+            state.failures += 1
+            delay = min(self.max_cooldown, self.base_cooldown * 2 ** (state.failures - 1))
+            delay *= random.uniform(0.5, 1.5)
+            state.cooldown_until = time.monotonic() + delay
+        logging.warning(f"API key {index + 1} of {self.total_keys} throttled, cooling down for {delay:.1f}s")
+
+class GeminiClient:
+    """
+    A Gemini model bound to one API key. genai.GenerativeModel always sends requests with
+    the key of the process-wide genai.configure(), so this goes through a
+    GenerativeServiceClient created with the key in its client options instead.
+    """
+    def __init__(self, api_key: str, model_name: str, generation_config: Dict[str, Any]):
+        self.model_name = model_name
+        self.generation_config = generation_config
+        self.service = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+
+    def generate_content(self, prompt: str, generation_config: Optional[Dict[str, Any]] = None):
+        """Sends one single-turn request; generation_config entries override the model's for this request."""
+        request = glm.GenerateContentRequest(
+            model=f"models/{self.model_name}",
+            contents=[glm.Content(role="user", parts=[glm.Part(text=prompt)])],
+            generation_config=glm.GenerationConfig(**{**self.generation_config, **(generation_config or {})}),
+        )
+        return genai.types.GenerateContentResponse.from_response(self.service.generate_content(request))
+
+def load_api_keys() -> List[str]:
+    """Reads keys from GEMINI_API_KEYS (comma separated) and GEMINI_API_KEY, without duplicates."""
+    keys = [key.strip() for key in os.environ.get("GEMINI_API_KEYS", "").split(",")]
+    keys.append(os.environ.get("GEMINI_API_KEY", ""))
+    return list(dict.fromkeys(key for key in keys if key))
+
+_key_manager = None
+_key_manager_lock = threading.Lock()
+
+def get_key_manager(requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE) -> APIKeyManager:
+    """
+    Process-wide key pool, so concurrent jobs share one view of each key's quota. It is
+    rebuilt, with fresh budgets, when the keys or the requests-per-minute limit change.
+    """
+    global _key_manager
+    with _key_manager_lock:
+        api_keys = load_api_keys()
+        if (_key_manager is None or _key_manager.api_keys != api_keys
+                or _key_manager.requests_per_minute != requests_per_minute):
+            _key_manager = APIKeyManager(api_keys=api_keys, requests_per_minute=requests_per_minute)
+        return _key_manager
 
 class AIModelEvaluator:
-    def __init__(self, api_key_manager: APIKeyManager, model_type="gemini", temperature=0.7):
+    def __init__(self, api_key_manager: APIKeyManager, model_type="gemini", temperature=0.7,
+                 concurrency: int = DEFAULT_CONCURRENCY, cache: Optional[LLMResponseCache] = None,
+                 client_factory: Optional[Callable[[str], Any]] = None, metrics: Optional[LLMMetrics] = None,
+                 classifier: Optional[MetadataClassifier] = None):
         self.model_type = model_type
+        self.model_name = "gemini-2.0-flash-exp"
+        self.cache = cache if cache is not None else get_response_cache()
+        self.metrics = metrics if metrics is not None else process_metrics
         self.temperature = temperature
         self.api_key_manager = api_key_manager
-        self.configure_current_key()
+        self.concurrency = max(1, concurrency)
+        self._usage_lock = threading.Lock()
+        self.usage = {"requests": 0, "prompt_tokens": 0, "output_tokens": 0, "metadata_tier": 0}
+        self.classifier = classifier
 
         self.generation_config = {
             "temperature": self.temperature,
@@ -67,18 +303,86 @@ class AIModelEvaluator:
             "max_output_tokens": 7500,   # Reduced to prevent excessive length
             "response_mime_type": "application/json",  # Expecting JSON response
         }
+        # The explanation-only prompt of the two-tier path needs far less room
+        self.explanation_config = dict(self.generation_config, max_output_tokens=EXPLANATION_MAX_OUTPUT_TOKENS)
 
-        self.client = genai.GenerativeModel(
-            model_name="gemini-2.0-flash-exp",
-            generation_config=self.generation_config,
-        )
+        # One client per key, so requests on different keys can run at the same time.
+        # client_factory swaps in another backend, e.g. offline_gemini for load tests.
+        build_client = client_factory or self._build_client
+        self.clients = [build_client(key) for key in self.api_key_manager.api_keys]
+
+    def _build_client(self, api_key: str):
+        return GeminiClient(api_key, self.model_name, self.generation_config)
+
+    def _send(self, prompt: str, call: Optional[Dict[str, Any]] = None, generation_config: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Sends one request on the next available key and records its token usage.
+        The key index and token counts are also stored in `call` for the per-call metrics record.
+        generation_config overrides the client's config for this request only.
+        """
+        # Rough prompt size estimate for the tokens-per-minute budget; corrected from usage_metadata below
+        estimated_tokens = len(prompt) // 4
+        key_index = self.api_key_manager.acquire(estimated_tokens)
+        if call is not None:
+            call["key_index"] = key_index
+        try:
+            response = self.clients[key_index].generate_content(prompt, generation_config=generation_config)
+        except genai_exceptions.ResourceExhausted:
+            self.api_key_manager.report_exhausted(key_index)
+            raise
 
-    def configure_current_key(self):
-        current_key = self.api_key_manager.get_current_key()
-        genai.configure(api_key=current_key)
-        logging.info(f"Using API Key {self.api_key_manager.current_index + 1} of {self.api_key_manager.total_keys}")
+        usage = getattr(response, "usage_metadata", None)
+        used_tokens = usage.prompt_token_count + usage.candidates_token_count if usage is not None else estimated_tokens
+        self.api_key_manager.report_success(key_index, used_tokens - estimated_tokens)
+        with self._usage_lock:
+            self.usage["requests"] += 1
+            if usage is not None:
+                self.usage["prompt_tokens"] += usage.prompt_token_count
+                self.usage["output_tokens"] += usage.candidates_token_count
+        if call is not None:
+            call["prompt_tokens"] = call.get("prompt_tokens", 0) + (usage.prompt_token_count if usage is not None else estimated_tokens)
+            call["output_tokens"] = call.get("output_tokens", 0) + (usage.candidates_token_count if usage is not None else 0)
+        return response.text
+
+    def _handle_quota_error(self, e):
+        # The throttled key is already cooling down; the retry picks another one
+        logging.error(f"API quota exceeded, retrying on the next available key: {e}")
+
+    def _cache_key(self, question: str, options: Dict[str, str], correct_option, generation_config=None) -> str:
+        return self.cache.make_key(self.model_name, generation_config or self.generation_config, question, options, correct_option)
+
+    def _classify(self, question: str, options: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        """First tier: metadata from the local classifier, or None when it is unavailable or unsure."""
+        if self.classifier is None:
+            return None
+        metadata, confident = self.classifier.predict(question, list((options or {}).values()))
+        if not confident:
+            return None
+        with self._usage_lock:
+            self.usage["metadata_tier"] += 1
+        return metadata
 
     def generate_explanations(self, question: str, options: Dict[str, str], correct_option: str) -> Union[Explain, Dict[str, Any]]:
+        metadata = self._classify(question, options)
+        cache_key = self._cache_key(question, options, correct_option,
+                                    self.explanation_config if metadata else None)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            self.metrics.record("explain", self.model_name, "ok", cache_hit=True)
+            return cached
+        return self._request_explanation(question, options, correct_option, cache_key, metadata)
+
+    def _request_explanation(self, question: str, options: Dict[str, str], correct_option: str, cache_key: str,
+                             metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Sends the full analysis prompt, or with metadata from the first tier, only asks for
+        the explanations under the smaller explanation_config output budget.
+        """
+        if metadata:
+            return self._send_for_explanation(
+                EXPLANATION_PROMPT.format(question=question, options=json.dumps(options, indent=4),
+                                          correct_option=correct_option, subject=metadata["Subject"], topic=metadata["Topic"]),
+                question, options, correct_option, cache_key, metadata, self.explanation_config)
         prompt = f"""
         You are an AI Evaluation Assistant designed to analyze and evaluate questions, providing structured and comprehensive feedback.
 
@@ -109,90 +413,282 @@ class AIModelEvaluator:
             "Negative_Feedback": "Provide negative feedback but detailed feedback, focusing on the student's misunderstanding of the key concepts and the topic. Identify the exact areas where they need improvement and offer a clear review in 2-3 sentences."
         }}
         """
+        return self._send_for_explanation(prompt, question, options, correct_option, cache_key)
+
+    def _send_for_explanation(self, prompt: str, question: str, options: Dict[str, str], correct_option: str, cache_key: str,
+                              metadata: Optional[Dict[str, Any]] = None, generation_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        call = {"retries": 0}
+        start = time.perf_counter()
+        def record(outcome):
+            self.metrics.record("explain", self.model_name, outcome, time.perf_counter() - start,
+                                tier="explanation" if metadata else "full", **call)
+
         while True:
             try:
-                chat_session = self.client.start_chat(history=[])
-                response = chat_session.send_message(prompt).text
-                print(f"\nResponse:{response}\n")
-                logging.info("Received response from Generative AI.")
+                response = self._send(prompt, call, generation_config)
+                logging.debug(f"Response: {response}")
 
-                # Attempt to parse the response directly as JSON
-                explanation_report = json.loads(response)
-                explanation_report = Explain(**explanation_report)
-                return explanation_report.dict()
+                # Repair near-JSON and keep whatever fields validate
+                item = repair_json(response)
+                if metadata and isinstance(item, dict):
+                    item.update(metadata)
+                explanation_report = salvage_explanation(item, question, options, correct_option)
+                # Provenance for the analyses table, so the classifier never trains on its own output
+                explanation_report["source"] = "classifier" if metadata else "gemini"
+                self.cache.put(cache_key, explanation_report)
+                record("ok")
+                return explanation_report
 
             except genai_exceptions.ResourceExhausted as e:
-                logging.error(f"API quota exceeded: {e}")
-                # Attempt to switch API key
-                if not self.api_key_manager.switch_key():
-                    logging.warning("All API keys have been exhausted. Waiting for 60 seconds before retrying...")
-                    time.sleep(60)
-                else:
-                    self.configure_current_key()
-                    logging.info("Switched to the next API key and retrying...")
+                if call["retries"] >= MAX_QUOTA_RETRIES:
+                    logging.error(f"Giving up after {call['retries']} quota retries: {e}")
+                    record("quota_exhausted")
+                    return {"error": QUOTA_ERROR}
+                call["retries"] += 1
+                self._handle_quota_error(e)
             
             except json.JSONDecodeError as e:
                 logging.error(f"Failed to parse JSON response: {e}")
                 logging.debug(f"Raw response: {response}")
+                record("invalid_json")
                 return {"error": "Invalid JSON response received from the model."}
+
+            except ValueError as e:
+                logging.error(f"Response failed validation: {e}")
+                record("invalid")
+                return {"error": f"Incomplete analysis received from the model: {e}"}
             
             except Exception as e:
                 logging.error(f"An unexpected error occurred: {e}")
+                record("error")
                 return {"error": "An unexpected error occurred during explanation generation."}
 
-    def generate_explanations_single_file(self,id, question_data: Union[List[Dict[str, Any]], Dict[str, Any]],outfile_path = 'generated_files/analysis.json' ) -> str:
-        if os.path.exists(outfile_path):
-            with open(outfile_path, 'r', encoding='utf-8') as file:
-                try:
-                    existing_data = json.load(file)
-                except json.JSONDecodeError:
-                    existing_data = {}
-        else:
-            existing_data = {}
-        questions = question_data if isinstance(question_data, list) else [question_data]
+    def _explain_one(self, question_entry: Dict[str, Any]) -> Dict[Any, Dict[str, Any]]:
+        return {question_entry.get("Question no", "N/A"): self.generate_explanations(
+            question_entry.get("Question", ""),
+            question_entry.get("options", {}),
+            question_entry.get("Correct Answer", "Unattempted"))}
+
+    def generate_explanations_batch(self, question_entries: List[Dict[str, Any]]) -> Dict[Any, Dict[str, Any]]:
+        """
+        Analyses several questions with one request and returns {question_no: explanation}.
+        Questions missing from the response or failing Explain validation are retried one by one.
+        The local metadata tier is not used here: the batched prompt asks Gemini for every field.
+        """
+        explanations = {}
+        uncached = []
+        for entry in question_entries:
+            cached = self.cache.get(self._cache_key(entry.get("Question", ""), entry.get("options", {}), entry.get("Correct Answer", "Unattempted")))
+            if cached is not None:
+                explanations[entry.get("Question no", "N/A")] = cached
+                self.metrics.record("explain", self.model_name, "ok", cache_hit=True)
+            else:
+                uncached.append(entry)
+        if not uncached:
+            return explanations
+        question_entries = uncached
 
-        connection = sqlite3.connect("Database/Questions.db")
-        cursor = connection.cursor()
-        for question_entry in questions:
-            question_no = question_entry.get("Question no", "N/A")
-            question = question_entry.get("Question", "")
-            options = question_entry.get("options", {})
-            correct_option = question_entry.get("Correct Answer", "Unattempted")
+        listing = "\n".join(
+            json.dumps({
+                "Question_no": str(entry.get("Question no", "N/A")),
+                "Question": entry.get("Question", ""),
+                "Options": entry.get("options", {}),
+                "Correct Answer": entry.get("Correct Answer", "Unattempted"),
+            }, ensure_ascii=False)
+            for entry in question_entries
+        )
+        prompt = BATCH_PROMPT.format(questions=listing)
+
+        items = []
+        call = {"retries": 0}
+        start = time.perf_counter()
+        outcome = "ok"
+        while True:
             try:
-                q=f"SELECT * FROM {id}_LLM WHERE Qno=?"
-                cursor.execute(q,(question_no,))
-                if cursor.fetchone()!=None:
-                    continue
-            except:
-                pass
-            explanation = self.generate_explanations(question, options, correct_option)
-            existing_data[question_no] = explanation
-            populate_analysis_db(connection,cursor,explanation,question_no,id)
+                response = self._send(prompt, call)
+                logging.info(f"Received batch response for {len(question_entries)} questions.")
+                items = repair_json(response)
+                if isinstance(items, dict):
+                    # Tolerate a wrapper object around the array
+                    items = next((v for v in items.values() if isinstance(v, list)), [])
+                break
+            except genai_exceptions.ResourceExhausted as e:
+                if call["retries"] >= MAX_QUOTA_RETRIES:
+                    logging.error(f"Giving up on a batch of {len(question_entries)} after {call['retries']} quota retries: {e}")
+                    outcome = "quota_exhausted"
+                    break
+                call["retries"] += 1
+                self._handle_quota_error(e)
+            except json.JSONDecodeError as e:
+                logging.error(f"Failed to parse batch JSON response: {e}")
+                outcome = "invalid_json"
+                break
+            except Exception as e:
+                logging.error(f"An unexpected error occurred during batch generation: {e}")
+                outcome = "error"
+                break
+        self.metrics.record("explain_batch", self.model_name, outcome, time.perf_counter() - start,
+                            questions=len(question_entries), **call)
+        if outcome == "quota_exhausted":
+            # Retrying one by one would only spend more of the quota that just ran out
+            explanations.update({entry.get("Question no", "N/A"): {"error": QUOTA_ERROR} for entry in question_entries})
+            return explanations
+
+        by_number = {str(item.get("Question_no")).strip(): item for item in items if isinstance(item, dict)}
+        retry = []
+        for entry in question_entries:
+            question_no = entry.get("Question no", "N/A")
+            item = by_number.get(str(question_no))
+            if item is None:
+                retry.append(entry)
+                continue
+            # The question, options and key are filled in locally rather than echoed back by the model
+            item.pop("Question_no", None)
             try:
-                with open(outfile_path, 'w', encoding='utf-8') as file:
-                    json.dump(existing_data, file, indent=4, ensure_ascii=False)
-                logging.info(f"Successfully saved explanation for Question {question_no} to {outfile_path}")
+                explanations[question_no] = salvage_explanation(item, entry.get("Question", ""), entry.get("options", {}),
+                                                                entry.get("Correct Answer", "Unattempted"))
+                self.cache.put(self._cache_key(entry.get("Question", ""), entry.get("options", {}), entry.get("Correct Answer", "Unattempted")),
+                               explanations[question_no])
             except Exception as e:
-                logging.error(f"Failed to save explanation for Question {question_no}: {e}")
+                logging.warning(f"Question {question_no} failed validation in batch response: {e}")
+                retry.append(entry)
+
+        if retry:
+            logging.info(f"Retrying {len(retry)} of {len(question_entries)} batched questions individually")
+        for entry in retry:
+            question, options, correct_option = entry.get("Question", ""), entry.get("options", {}), entry.get("Correct Answer", "Unattempted")
+            explanations[entry.get("Question no", "N/A")] = self._request_explanation(
+                question, options, correct_option, self._cache_key(question, options, correct_option))
+        return explanations
+
+    def generate_explanations_single_file(self,id, question_data: Union[List[Dict[str, Any]], Dict[str, Any]],outfile_path = 'generated_files/analysis.json', progress: Optional[Callable[[int, int], None]] = None,
+                                          batch_size: int = DEFAULT_BATCH_SIZE,
+                                          on_result: Optional[Callable[[Any, Dict[str, Any]], None]] = None) -> str:
+        """
+        Analyses every question of paper id that has no stored analysis yet. Questions that have
+        one are reported from the database, to on_result and the log, before any request is sent.
+        progress(done, total) is reported as questions are processed, including ones already analysed.
+        With batch_size > 1, questions are packed batch_size to a request.
+        on_result(question_no, explanation) is called once each result is committed; analyses are
+        written in batches, so results are reported batch by batch. Results that are not stored,
+        such as errors, are reported at once.
+
+        Results are appended to the paper's JSON Lines log next to outfile_path, which is then
+        compacted into outfile_path once the paper is done.
+        """
+        questions = question_data if isinstance(question_data, list) else [question_data]
+
+        wanted = {int(question_entry.get("Question no", -1)) for question_entry in questions}
+        stored = {row["Qno"]: stored_explanation(row) for row in paper_analyses(db.connection().cursor(), id)
+                  if row["Qno"] in wanted}
+        pending = [question_entry for question_entry in questions
+                   if int(question_entry.get("Question no", -1)) not in stored]
+
+        done = len(questions) - len(pending)
+        if progress:
+            progress(done, len(questions))
+        logging.info(f"Analysing {len(pending)} of {len(questions)} questions with concurrency {self.concurrency}")
+
+        # The paper's log is rebuilt on every run: analyses already stored (from an earlier run,
+        # a prewarm or reuse from another paper) first, then the new ones as they come in
+        with AnalysisLog(log_path_for(outfile_path, id), restart=True) as analysis_log:
+            for question_no, explanation in stored.items():
+                analysis_log.append(id, question_no, explanation)
+                if on_result:
+                    on_result(question_no, explanation)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            if batch_size > 1:
+                futures = [pool.submit(self.generate_explanations_batch, pending[i:i + batch_size])
+                           for i in range(0, len(pending), batch_size)]
+            else:
+                futures = [pool.submit(self._explain_one, question_entry) for question_entry in pending]
+            # Queued results by question number, reported to on_result once their batch commits
+            uncommitted = {}
+            def committed(rows):
+                for _, qno, *_ in rows:
+                    question_no, explanation = uncommitted.pop(qno, (None, None))
+                    if on_result and explanation is not None:
+                        on_result(question_no, explanation)
+
+            # Results are stored from this thread only, so the DB and the log see one writer
+            with AnalysisLog(log_path_for(outfile_path, id)) as analysis_log, analysis_writer(on_flush=committed) as writer:
+                for future in as_completed(futures):
+                    for question_no, explanation in future.result().items():
+                        analysis_log.append(id, question_no, explanation)
+                        uncommitted[int(question_no)] = (question_no, explanation)
+                        if save_analysis(writer, id, question_no, explanation):
+                            logging.info(f"Saved explanation for Question {question_no}")
+                        elif on_result:
+                            on_result(*uncommitted.pop(int(question_no)))
+                        done += 1
+                        if progress:
+                            progress(done, len(questions))
+
+        try:
+            compact(log_path_for(outfile_path, id), outfile_path, paper_id=id)
+        except Exception as e:
+            logging.error(f"Failed to write {outfile_path}: {e}")
+
+        self.cache.log_stats()
+        if pending:
+            requests, prompt_tokens, output_tokens = (self.usage[k] for k in ("requests", "prompt_tokens", "output_tokens"))
+            logging.info(f"Paper {id}: {requests} requests for {len(pending)} questions (batch size {batch_size}), "
+                         f"{prompt_tokens / len(pending):.0f} prompt + {output_tokens / len(pending):.0f} output tokens per question, "
+                         f"{self.usage['metadata_tier']} with metadata from the local classifier")
                 
-        connection.commit()
-        connection.close()
+        if progress:
+            progress(len(questions), len(questions))
 
         return outfile_path
 
-def Assistant(question_data, id, model_name:str="Gemini 1.5 Pro",output_path='generated_files/analysis.json') -> str:
-    api_keys = [
-        os.environ.get('GEMINI_API_KEY')
-    ]
+def Assistant(question_data, id, model_name:str="Gemini 1.5 Pro",output_path='generated_files/analysis.json',progress=None,
+              concurrency: int = DEFAULT_CONCURRENCY, requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+              batch_size: int = DEFAULT_BATCH_SIZE, client_factory=None, on_result=None,
+              metrics: Optional[LLMMetrics] = None, metadata_tier: str = METADATA_TIER) -> str:
+    classifier = None
+    if metadata_tier == "local" and batch_size > 1:
+        # Batched prompts always ask for every field, so the local tier only serves unbatched runs
+        logging.info(f"Batch size {batch_size}: local metadata tier skipped, using Gemini for all fields")
+    elif metadata_tier == "local":
+        classifier = trained_classifier(db.connection())
+        if classifier is None:
+            logging.info("Too few analysed questions to train the metadata classifier, using Gemini for all fields")
+        else:
+            logging.info(f"Metadata classifier trained on {len(classifier)} analysed questions")
 
-    api_key_manager = APIKeyManager(api_keys=api_keys)
     evaluator = AIModelEvaluator(
-        api_key_manager=api_key_manager,
+        api_key_manager=get_key_manager(requests_per_minute),
         model_type=model_name,
-        temperature=0.5
+        temperature=0.5,
+        concurrency=concurrency,
+        client_factory=client_factory,
+        metrics=metrics,
+        classifier=classifier
     )
 
-    outfile = evaluator.generate_explanations_single_file(id,question_data,output_path)
+    outfile = evaluator.generate_explanations_single_file(id,question_data,output_path,progress=progress,batch_size=batch_size,
+                                                          on_result=on_result)
+    return outfile
+
+def repair_analyses(id, output_path='generated_files/analysis.json', concurrency: int = DEFAULT_CONCURRENCY,
+                    requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE, batch_size: int = DEFAULT_BATCH_SIZE,
+                    client_factory=None, progress=None) -> List[int]:
+    """
+    Re-analyses only the questions of paper id that have no analysis row, either because
+    they were never analysed or because the model's answer could not be used.
+    Returns the question numbers that were retried.
+    """
+    cursor = db.connection().cursor()
+    missing = missing_analyses(cursor, id)
+    questions = load_questions(cursor, id, missing)
+    if not missing:
+        logging.info(f"Paper {id}: every question is analysed, nothing to repair")
+        return []
+    logging.info(f"Paper {id}: repairing {len(missing)} questions {missing}")
+    Assistant(questions, id, output_path=output_path, progress=progress, concurrency=concurrency,
+              requests_per_minute=requests_per_minute, batch_size=batch_size, client_factory=client_factory)
+    return missing
 
 if __name__ == "__main__":
     single_file_path = "generated_files\question_paper_qp_1.json" # Replace with the path to your input JSON file
@@ -0,0 +1,30 @@
+"""
+Export graded report rows for analytics.
+
+Streams student, paper, question number, score, subject, topic, difficulty, taxonomy
+and student option for every graded answer into a Parquet file, or into an Arrow IPC
+file (.arrow, .feather or .ipc) that can be memory-mapped downstream with
+pyarrow.ipc.open_file(pyarrow.memory_map(path)). Rows are read and written in batches,
+so memory use does not grow with the number of students. Run from backend_src:
+
+    python export_results.py generated_files/exports/results.parquet --paper qp_1
+"""
+import argparse
+
+from arrow_export import EXPORT_BATCH_ROWS, export_results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output", help="Output file; .arrow, .feather or .ipc for Arrow IPC, anything else for Parquet")
+    parser.add_argument("--paper", help="Only export this Question Paper ID")
+    parser.add_argument("--student", help="Only export this Student ID")
+    parser.add_argument("--format", choices=("parquet", "arrow"), help="Override the format implied by the extension")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_ROWS, help="Rows read and written per batch")
+    args = parser.parse_args()
+
+    rows = export_results(args.output, paper_id=args.paper, student_id=args.student, batch_size=args.batch_size,
+                          fmt=args.format)
+    print(f"{args.output}: {rows} rows")
+
+if __name__ == "__main__":
+    main()
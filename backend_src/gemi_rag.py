@@ -13,6 +13,7 @@ from langchain.memory import ConversationBufferMemory, ChatMessageHistory
 from langchain.chains import ConversationalRetrievalChain
 from langchain_core.runnables import RunnablePassthrough
 import logging
+from llm_metrics import MetricsCallbackHandler, metrics
 
 
 logging.basicConfig(level=logging.INFO)
@@ -123,7 +124,9 @@ class Ask_Gemini():
         #     return_source_documents=True
         # )
 
-        results = chain.invoke(question)
+        # Records the query-generation and answer calls separately
+        callback = MetricsCallbackHandler(metrics, source="rag", model="gemini-2.0-flash-exp")
+        results = chain.invoke(question, config={"callbacks": [callback]})
         logging.info("RAG setup completed successfully.")
         return results
 
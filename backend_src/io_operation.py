@@ -1,6 +1,8 @@
+import codecs
+import itertools
 import os
 import re
-import sqlite3
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
 import fitz 
 import json
@@ -10,9 +12,34 @@ import re,json
 import re
 import json
 import os
-from database import populate_q_db
+from typing import Iterable, Iterator, Union
+from database import db, save_questions
+from question_index import reuse_analyses
 from logger_config import logging
 
+# Documents shorter than this are read serially; spinning up a process pool
+# costs more than it saves on a handful of pages.
+PARALLEL_MIN_PAGES = 32
+MIN_PAGES_PER_TASK = 8
+
+STREAM_CHUNK_SIZE = 64 * 1024
+ID_WINDOW_SIZE = 64
+QUESTION_PAPER_ID_PATTERN = re.compile(r"(?i)\bquestion[\s_-]*paper[\s_-]*id[:\s]*([\w\d]+)")
+STUDENT_ID_PATTERN = re.compile(r"(?i)\bstudent[\s_-]*id[:\s]*([\w\d]+)")
+QUESTION_BODY = r"(\d+)\.\s(.*?)(?:A\))(.*?)B\)(.*?)C\)(.*?)D\)(.*?)"
+# Mid-stream a question is only complete once the next question number has been read
+COMPLETE_QUESTION_PATTERN = re.compile(QUESTION_BODY + r"(?=\d+\.)", re.DOTALL)
+LAST_QUESTION_PATTERN = re.compile(QUESTION_BODY + r"(?=\d+\.|$)", re.DOTALL)
+ANSWER_PATTERN = re.compile(r"(\d+)\.\s*([A-Da-d]|Unattempted)")
+
+def _extract_page_range(file_path, start, end):
+    """
+    Process pool worker: extracts the text of pages [start, end) of a PDF file.
+    """
+    with open(file_path, "rb") as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [pdf_reader.pages[page_num].extract_text() for page_num in range(start, end)]
+
 class PDFProcessor:
     def __init__(self):
         self.outpath = 'generated_files'
@@ -24,62 +51,110 @@ class PDFProcessor:
             return outpath
         
         elif file_type == 'answer_sheet':
-            txt = self.read_pdf(path)
-            self.answer_sheet = self.format_answers(txt)
+            self.answer_sheet = self.format_answers(self.iter_pdf_pages(path))
             s_id=self.answer_sheet["Student ID"]
             q_id=self.answer_sheet["Question Paper ID"]
             return self.answer_sheet,s_id,q_id
         else:
-            txt = self.read_pdf(path)
-            self.answer_key = self.format_answers(txt) 
+            self.answer_key = self.format_answers(self.iter_pdf_pages(path)) 
             return self.answer_key
         
-    def read_pdf(self,file_path):
+    def read_pdf(self,file_path,parallel=False,workers=None):
         """
         Reads and extracts text from a PDF file.
         """
-        text = ""
+        return "".join(page + "\n" for page in self.iter_pdf_pages(file_path,parallel=parallel,workers=workers))
+
+    def iter_pdf_pages(self,file_path,parallel=None,workers=None) -> Iterator[str]:
+        """
+        Yields the text of each page of a PDF file in page order.
+
+        With parallel=True the page ranges are split across a process pool and
+        yielded back in order as each range completes. parallel=None picks the
+        pool only for documents of at least PARALLEL_MIN_PAGES pages, and only on
+        a machine with more than one CPU, where the pool can actually overlap work.
+        """
         with open(file_path, "rb") as file:
             pdf_reader = PyPDF2.PdfReader(file)
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                text += page.extract_text() + "\n"
-        return text
+            total_pages = len(pdf_reader.pages)
+            if parallel is None:
+                parallel = total_pages >= PARALLEL_MIN_PAGES and (os.cpu_count() or 1) > 1
+            if not parallel or total_pages <= MIN_PAGES_PER_TASK:
+                for page_num in range(total_pages):
+                    yield pdf_reader.pages[page_num].extract_text()
+                return
 
-    def extract_questions(self,path:str,out:str):
+        workers = workers or os.cpu_count() or 1
+        # A couple of ranges per worker keeps the pool busy without re-parsing
+        # the document once per page.
+        pages_per_task = max(MIN_PAGES_PER_TASK, -(-total_pages // (workers * 2)))
+        ranges = [(start, min(start + pages_per_task, total_pages))
+                  for start in range(0, total_pages, pages_per_task)]
+        logging.debug(f"Extracting {total_pages} pages of {file_path} in {len(ranges)} ranges on {workers} workers")
+        with ProcessPoolExecutor(max_workers=min(workers, len(ranges))) as pool:
+            futures = [pool.submit(_extract_page_range, file_path, start, end) for start, end in ranges]
+            for future in futures:
+                yield from future.result()
 
-        # extractor = Extractor().set_ocr_config(TesseractOcrConfig().set_language("deu"))
-        # result, _ = extractor.extract_file_to_string("QuestionPaper.pdf")
+    def iter_questions(self,path:str,chunk_size:int=STREAM_CHUNK_SIZE) -> Iterator[dict]:
+        """
+        Streams a question paper and yields each parsed question as soon as it is complete.
 
+        The document is read in chunks, so memory is bounded by the longest question
+        rather than the paper. A question is only emitted once the next question
+        number has been read; whatever is left at the end of the stream is parsed
+        as the last question. The paper ID is stored on self.question_paper_id.
+        """
         extractor = Extractor()
-        extractor.set_extract_string_max_length(10000)
+        reader, metadata = extractor.extract_file(path)
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
 
-        # Extract text from a file
-        result, metadata = extractor.extract_file_to_string(path)
+        self.question_paper_id = "Unknown"
+        id_window = ""
+        buffer = ""
+        eof = False
+        while not eof:
+            chunk = reader.read(chunk_size)
+            eof = not chunk
+            text = decoder.decode(bytes(chunk), final=eof)
 
-        question_paper_id_pattern = r"(?i)\bquestion[\s_-]*paper[\s_-]*id[:\s]*([\w\d]+)"
-        question_paper_id_match = re.search(question_paper_id_pattern, result.lower())
-        question_paper_id = question_paper_id_match.group(1) if question_paper_id_match else "Unknown"
+            if self.question_paper_id == "Unknown":
+                # Keep a short tail so an ID split across two chunks is still found
+                id_window = id_window[-ID_WINDOW_SIZE:] + text.lower()
+                question_paper_id_match = QUESTION_PAPER_ID_PATTERN.search(id_window)
+                if question_paper_id_match and (eof or question_paper_id_match.end() < len(id_window)):
+                    self.question_paper_id = question_paper_id_match.group(1)
 
-        pattern = r"(\d+)\.\s(.*?)(?:A\))(.*?)B\)(.*?)C\)(.*?)D\)(.*?)(?=\d+\.|$)"
+            buffer += text
+            pattern = LAST_QUESTION_PATTERN if eof else COMPLETE_QUESTION_PATTERN
+            pos = 0
+            for match in pattern.finditer(buffer):
+                pos = match.end()
+                yield self._parse_question(match)
+            buffer = buffer[pos:]
 
-        matches = re.findall(pattern, result, re.DOTALL)
-        
-        data =[]
-        for match in matches:
-            q = match[1].strip()
-            op = [match[2].strip(), match[3].strip(), match[4].strip(), match[5].strip()]
-            options = {}
-            c=1
-            for i in op:
-                    options[c]=i
-                    c+=1
-            question_no=match[0].strip()
-            data.append({
-                "Question no": int(question_no),
-                "Question": q,
-                "options": options
-            })
+    def _parse_question(self,match) -> dict:
+        q = match.group(2).strip()
+        op = [match.group(3).strip(), match.group(4).strip(), match.group(5).strip(), match.group(6).strip()]
+        options = {}
+        c=1
+        for i in op:
+                options[c]=i
+                c+=1
+        question_no=match.group(1).strip()
+        return {
+            "Question no": int(question_no),
+            "Question": q,
+            "options": options
+        }
+
+    def extract_questions(self,path:str,out:str):
+
+        # extractor = Extractor().set_ocr_config(TesseractOcrConfig().set_language("deu"))
+        # result, _ = extractor.extract_file_to_string("QuestionPaper.pdf")
+
+        data = list(self.iter_questions(path))
+        question_paper_id = self.question_paper_id
 
         with open(out+question_paper_id+".json", "w", encoding="utf-8") as json_file:
             json.dump(data, json_file, indent=4, ensure_ascii=False)
@@ -88,19 +163,17 @@ class PDFProcessor:
     def merge_answers_with_questions(self,quest_paper):
         merged_json = []
 
+        # Index the answer key once; the first answer given for a question wins
+        answers = {}
+        for ans in self.answer_key['answers']:
+            answers.setdefault(str(ans.get("Question no")).strip(), ans.get("option"))
+
         # Iterate through each question in quest_paper
         for question in quest_paper:
             question_no = str(question.get("Question no")).strip()
 
-            # Find the corresponding answer in the answer key
-            print(f"answer:{self.answer_key}")
-            correct_option = None
-            # for answer in self.answer_key:
-            for ans in self.answer_key['answers']:
-                    if str(ans.get("Question no")).strip() == question_no:
-                        correct_option = ans.get("option")
-                        break
             # Add the correct answer to the question
+            correct_option = answers.get(question_no)
             if correct_option:
                 question['Correct Answer'] = correct_option
             else:
@@ -108,36 +181,58 @@ class PDFProcessor:
 
             merged_json.append(question)
 
-            q_paper = self.answer_key['Question Paper ID']
-            file_path = f"QA_{q_paper}.json"
-            with open(f"{self.outpath}/{file_path}", 'w') as f:
-                    json.dump(merged_json, f, indent=4)
-            connection = sqlite3.connect("Database/Questions.db")
-            cursor = connection.cursor()
-            populate_q_db(question,q_paper,connection,cursor)
-            connection.commit()
+        q_paper = self.answer_key['Question Paper ID']
+        file_path = f"QA_{q_paper}.json"
+        with open(f"{self.outpath}/{file_path}", 'w') as f:
+                json.dump(merged_json, f, indent=4)
+
+        save_questions(q_paper, merged_json)
+        reuse_analyses(merged_json, q_paper, db.connection())
         logging.info(f"Question Paper data updated in DB")
-        connection.close()
         return merged_json,q_paper
 
     
-    def format_answers(self, answer_key_text: str):
-        # Patterns for extracting Question Paper ID and Student ID
-        question_paper_id_pattern = r"(?i)\bquestion[\s_-]*paper[\s_-]*id[:\s]*([\w\d]+)"
-        student_id_pattern = r"(?i)\bstudent[\s_-]*id[:\s]*([\w\d]+)"
-
-        # Extract IDs
-        question_paper_id_match = re.search(question_paper_id_pattern, answer_key_text.lower())
-        student_id_match = re.search(student_id_pattern, answer_key_text.lower())
-        question_paper_id = question_paper_id_match.group(1) if question_paper_id_match else "Unknown"
-        student_id = student_id_match.group(1) if student_id_match else "Unknown"
+    def format_answers(self, answer_key_text: Union[str, Iterable[str]]):
+        # Accept either the full text or an iterable of page texts, so parsing
+        # can start while later pages are still being extracted.
+        pages = [answer_key_text] if isinstance(answer_key_text, str) else answer_key_text
 
-        # Split the answer key by subject headings (e.g., "Physics:")
-        subject_split_pattern = r"(\w+):\s*\n"
-        subjects = re.split(subject_split_pattern, answer_key_text)
+        option_mapping = {"A": 1, "B": 2, "C": 3, "D": 4, "UNATTEMPTED": "Unattempted"}
 
+        question_paper_id = "Unknown"
+        student_id = "Unknown"
         formatted_result = []
-        option_mapping = {"A": 1, "B": 2, "C": 3, "D": 4, "UNATTEMPTED": "Unattempted"}
+        id_window = buffer = ""
+        # A final empty page flushes whatever was held back from the last real page
+        for page_text in itertools.chain(pages, [None]):
+            eof = page_text is None
+            text = "" if eof else page_text
+
+            # Keep a short tail of the previous page so an ID split across a page break is still found
+            id_window = id_window[-ID_WINDOW_SIZE:] + text.lower()
+            if question_paper_id == "Unknown":
+                question_paper_id_match = QUESTION_PAPER_ID_PATTERN.search(id_window)
+                if question_paper_id_match and (eof or question_paper_id_match.end() < len(id_window)):
+                    question_paper_id = question_paper_id_match.group(1)
+            if student_id == "Unknown":
+                student_id_match = STUDENT_ID_PATTERN.search(id_window)
+                if student_id_match and (eof or student_id_match.end() < len(id_window)):
+                    student_id = student_id_match.group(1)
+
+            # Text after the last parsed answer is carried into the next page, and an
+            # answer ending exactly at a page break waits in case it continues there
+            buffer += text
+            pos = 0
+            for match in ANSWER_PATTERN.finditer(buffer):
+                if not eof and match.end() == len(buffer):
+                    break
+                pos = match.end()
+                question_no, option = match.groups()
+                formatted_result.append({"Question no": int(question_no), "option": option_mapping[option.upper()]})
+            buffer = buffer[pos:]
+            if len(buffer) > ID_WINDOW_SIZE:
+                # Only the tail can hold a split answer; drop digits the cut left behind
+                buffer = re.sub(r"^\d+", "", buffer[-ID_WINDOW_SIZE:])
 
         # if len(subjects) > 1:  # More than one section
         #     for subject_text in subjects[1:]:  # Skip the first part as it's the unmatched text
@@ -150,12 +245,6 @@ class PDFProcessor:
         #         ]
         #         formatted_result.extend(formatted_answers)
         # else:  # No subject divisions, process entire text
-        answer_pattern = r"(\d+)\.\s*([A-Da-d]|Unattempted)"
-        answers = re.findall(answer_pattern, answer_key_text)
-        formatted_result = [
-                {"Question no": int(question_no), "option": option_mapping[option.upper()]}
-                for question_no, option in answers
-        ]
         print(formatted_result)
         # Define output file path
         if student_id != "Unknown":
@@ -0,0 +1,153 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from logger_config import logging
+
+MAX_WORKERS = 4
+MAX_PENDING = 32
+MAX_FINISHED = 256
+KEEPALIVE_SECONDS = 15.0
+
+class QueueFullError(Exception):
+    pass
+
+class Job:
+    """State of one background job: stage, progress and timings, safe to read from request threads."""
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = "queued"
+        self.stage = "queued"
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        # Set by jobs that work on one question paper, once it is known
+        self.paper_id = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.stage_times = {}
+        self._stage_started = None
+        self._lock = threading.Lock()
+        self._events = []
+        self._events_changed = threading.Condition()
+
+    def set_stage(self, stage: str):
+        with self._lock:
+            now = time.time()
+            if self._stage_started is not None:
+                self.stage_times[self.stage] = round(now - self._stage_started, 3)
+            self.status = "running"
+            self.stage = stage
+            self._stage_started = now
+        self.publish("stage", {"stage": stage})
+
+    def publish(self, event: str, data):
+        """Records an event for stream subscribers; events are kept for the job's lifetime so clients can resume."""
+        with self._events_changed:
+            self._events.append((event, data))
+            self._events_changed.notify_all()
+
+    def events(self, start: int = 0, keepalive: float = KEEPALIVE_SECONDS):
+        """
+        Yields (index, event, data) from index `start` as they are published, until the job
+        finishes. Yields None after `keepalive` seconds without events.
+        """
+        index = start
+        while True:
+            with self._events_changed:
+                if index >= len(self._events) and not self.finished:
+                    self._events_changed.wait(keepalive)
+                pending = self._events[index:]
+                finished = self.finished
+            if not pending:
+                if finished:
+                    return
+                yield None
+            for event, data in pending:
+                yield index, event, data
+                index += 1
+
+    def set_progress(self, done: int, total: int):
+        with self._lock:
+            self.done = done
+            self.total = total
+
+    def finish(self, result=None, error=None):
+        self.set_stage("done" if error is None else "failed")
+        with self._lock:
+            self.status = self.stage
+            self.result = result
+            self.error = error
+        with self._events_changed:
+            self._events.append((self.status, {"result": result, "error": error}))
+            self.finished_at = time.time()
+            self._events_changed.notify_all()
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            end = self.finished_at or time.time()
+            return {
+                "job_id": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "stage": self.stage,
+                "progress": {"done": self.done, "total": self.total},
+                "elapsed_seconds": round(end - self.created_at, 3),
+                "stage_seconds": dict(self.stage_times),
+                "result": self.result,
+                "error": self.error,
+            }
+
+class JobManager:
+    """
+    Runs jobs on a bounded thread pool. submit() rejects new work once max_pending
+    jobs are waiting or running, and only the most recent finished jobs are kept.
+    """
+    def __init__(self, max_workers=MAX_WORKERS, max_pending=MAX_PENDING, max_finished=MAX_FINISHED):
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, fn, *args, **kwargs) -> Job:
+        """Queues fn(job, *args, **kwargs); its return value becomes the job result."""
+        job = Job(kind)
+        with self._lock:
+            active = sum(1 for j in self._jobs.values() if not j.finished)
+            if active >= self.max_pending:
+                raise QueueFullError(f"{active} jobs already pending")
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def latest(self, kind: str = None):
+        with self._lock:
+            jobs = [j for j in self._jobs.values() if kind is None or j.kind == kind]
+        return max(jobs, key=lambda j: j.created_at) if jobs else None
+
+    def _run(self, job: Job, fn, args, kwargs):
+        job.set_stage("starting")
+        try:
+            job.finish(result=fn(job, *args, **kwargs))
+            logging.info(f"Job {job.id} ({job.kind}) finished in {job.to_dict()['elapsed_seconds']}s")
+        except Exception as e:
+            logging.exception(f"Job {job.id} ({job.kind}) failed")
+            job.finish(error=str(e))
+
+    def _prune(self):
+        finished = sorted((j for j in self._jobs.values() if j.finished), key=lambda j: j.finished_at)
+        for job in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job.id]
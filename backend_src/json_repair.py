@@ -0,0 +1,81 @@
+import json
+import re
+
+from logger_config import logging
+
+CLOSERS = {"{": "}", "[": "]"}
+
+def _strip_fences(text: str) -> str:
+    """Drops markdown code fences and any prose around the outermost JSON value."""
+    text = re.sub(r"```(?:json)?", "", text).strip()
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    return text[min(starts):] if starts else text
+
+def _scan(text: str):
+    """
+    Walks text outside of string literals.
+    Returns (end, stack, in_string, cuts): the index just past the first complete value
+    (or None if it is truncated), the brackets still open at the end, whether the text
+    ends inside a string, and (index, stack) for every top-level-safe comma seen.
+    """
+    stack, cuts = [], []
+    in_string = escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in CLOSERS:
+            stack.append(ch)
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return i + 1, [], False, cuts
+        elif ch == ",":
+            cuts.append((i, list(stack)))
+    return None, stack, in_string, cuts
+
+def _close(text: str, stack: list) -> str:
+    text = re.sub(r"[\s,:]+$", "", text)
+    return text + "".join(CLOSERS[b] for b in reversed(stack))
+
+def _loads(text: str):
+    # strict=False accepts raw newlines and tabs inside strings
+    return json.loads(re.sub(r",(\s*[}\]])", r"\1", text), strict=False)
+
+def repair_json(text: str):
+    """
+    Parses model output that is almost JSON.
+
+    Handles code fences, surrounding prose, trailing commas, raw control characters
+    in strings and output truncated by max_output_tokens. A truncated value is closed
+    off after the last complete member, so everything before the cut is kept.
+    Raises json.JSONDecodeError if nothing can be salvaged.
+    """
+    try:
+        return json.loads(text)
+    except (json.JSONDecodeError, TypeError):
+        pass
+    text = _strip_fences(str(text))
+    end, stack, in_string, cuts = _scan(text)
+    if end is not None:
+        return _loads(text[:end])
+
+    logging.warning("Model output was truncated, closing its open strings and brackets")
+    try:
+        return _loads(_close(text + ('"' if in_string else ""), stack))
+    except json.JSONDecodeError as e:
+        error = e
+    # The last member itself may be cut mid-way; drop members until the rest parses
+    for index, cut_stack in reversed(cuts):
+        try:
+            return _loads(_close(text[:index], cut_stack))
+        except json.JSONDecodeError as e:
+            error = e
+    raise error
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from logger_config import logging
+
+CACHE_PATH = "Database/llm_cache.db"
+MAX_ENTRIES = 50000
+MAX_AGE_DAYS = 90
+
+def normalize_text(text) -> str:
+    """Unicode-normalises, collapses whitespace and lowercases question text."""
+    text = unicodedata.normalize("NFKC", str(text))
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+class LLMResponseCache:
+    """
+    Persistent SQLite cache of validated question analyses.
+
+    Keys hash the model name, generation config, normalised question, options and
+    correct option, so an identical question is only sent to the API once. Entries
+    older than max_age_days are dropped on read, and the least recently used entries
+    are evicted once max_entries is exceeded.
+    """
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES, max_age_days=MAX_AGE_DAYS):
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 24 * 3600
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('''
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            created REAL NOT NULL,
+            accessed REAL NOT NULL
+        )''')
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+        self._connection.commit()
+
+    @staticmethod
+    def make_key(model_name: str, generation_config: dict, question: str, options: dict, correct_option) -> str:
+        payload = json.dumps({
+            "model": model_name,
+            "config": generation_config,
+            "question": normalize_text(question),
+            "options": {str(k): normalize_text(v) for k, v in (options or {}).items()},
+            "correct": normalize_text(correct_option),
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.max_age:
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._connection.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._connection.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, key: str, value: dict):
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now))
+            self._evict(now)
+            self._connection.commit()
+
+    def _evict(self, now):
+        self._connection.execute("DELETE FROM responses WHERE created < ?", (now - self.max_age,))
+        (count,) = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()
+        if count > self.max_entries:
+            self._connection.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT ?)",
+                (count - self.max_entries,))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+    def log_stats(self):
+        stats = self.stats()
+        logging.info(f"LLM response cache so far: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)")
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache() -> LLMResponseCache:
+    """
+    Process-wide cache at CACHE_PATH, so every evaluator shares one SQLite connection
+    instead of opening its own per analysis run. Its hit counts span the process.
+    """
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = LLMResponseCache()
+        return _response_cache
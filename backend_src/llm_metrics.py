@@ -0,0 +1,131 @@
+import json
+import statistics
+import threading
+import time
+from collections import Counter, deque
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from logger_config import logging
+
+# Upper bounds of the histogram buckets; anything larger lands in the overflow bucket
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 8000)
+MAX_RECORDS = 10000
+
+def histogram(values, bounds) -> dict:
+    counts = Counter()
+    for value in values:
+        counts[next((f"<={b}" for b in bounds if value <= b), f">{bounds[-1]}")] += 1
+    return {label: counts[label] for label in [f"<={b}" for b in bounds] + [f">{bounds[-1]}"]}
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[int(q) - 1]
+
+class LLMMetrics:
+    """
+    Structured records of LLM calls: source, model, API key index, prompt and output
+    tokens, latency, retries, cache hit and outcome.
+
+    Every record is logged as one JSON line and kept in a bounded window for summary().
+    A child collector (e.g. one per job) also forwards its records to its parent, so the
+    process-wide collector sees every call.
+    """
+    def __init__(self, parent=None, max_records=MAX_RECORDS):
+        self.parent = parent
+        self._records = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    def child(self) -> "LLMMetrics":
+        return LLMMetrics(parent=self, max_records=self._records.maxlen)
+
+    def record(self, source: str, model: str, outcome: str, latency: float = 0.0, key_index=None,
+               prompt_tokens: int = 0, output_tokens: int = 0, retries: int = 0, cache_hit: bool = False, **extra):
+        record = {"source": source, "model": model, "key_index": key_index, "prompt_tokens": prompt_tokens,
+                  "output_tokens": output_tokens, "latency": round(latency, 4), "retries": retries,
+                  "cache_hit": cache_hit, "outcome": outcome, "time": time.time(), **extra}
+        logging.info(f"LLM call {json.dumps(record)}")
+        self._add(record)
+
+    def _add(self, record: dict):
+        with self._lock:
+            self._records.append(record)
+        if self.parent is not None:
+            self.parent._add(record)
+
+    def records(self) -> list:
+        with self._lock:
+            return list(self._records)
+
+    def summary(self) -> dict:
+        """Totals per outcome, source and key, plus latency and output token histograms of uncached calls."""
+        records = self.records()
+        sent = [r for r in records if not r["cache_hit"]]
+        latencies = sorted(r["latency"] for r in sent)
+        by_key = {}
+        for r in sent:
+            key = by_key.setdefault(str(r["key_index"]), {"calls": 0, "prompt_tokens": 0, "output_tokens": 0})
+            key["calls"] += 1
+            key["prompt_tokens"] += r["prompt_tokens"]
+            key["output_tokens"] += r["output_tokens"]
+        return {
+            "calls": len(records),
+            "cache_hits": len(records) - len(sent),
+            "cache_hit_rate": round((len(records) - len(sent)) / len(records), 3) if records else 0.0,
+            "retries": sum(r["retries"] for r in records),
+            "prompt_tokens": sum(r["prompt_tokens"] for r in sent),
+            "output_tokens": sum(r["output_tokens"] for r in sent),
+            "outcomes": dict(Counter(r["outcome"] for r in records)),
+            "sources": dict(Counter(r["source"] for r in records)),
+            "keys": by_key,
+            "latency_seconds": {
+                "p50": round(percentile(latencies, 50), 3),
+                "p95": round(percentile(latencies, 95), 3),
+                "max": round(latencies[-1], 3) if latencies else 0.0,
+                "histogram": histogram(latencies, LATENCY_BUCKETS),
+            },
+            "output_tokens_histogram": histogram([r["output_tokens"] for r in sent], TOKEN_BUCKETS),
+        }
+
+# Process-wide collector; jobs record into a child of it
+metrics = LLMMetrics()
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """LangChain callback recording one LLMMetrics entry per chat model or LLM call in a chain."""
+    def __init__(self, collector: LLMMetrics, source: str, model: str):
+        self.collector = collector
+        self.source = source
+        self.model = model
+        self._started = {}
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        prompt_tokens = output_tokens = 0
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage:
+            prompt_tokens = usage.get("prompt_tokens", 0)
+            output_tokens = usage.get("completion_tokens", 0)
+        else:
+            for generations in response.generations:
+                for generation in generations:
+                    meta = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    prompt_tokens += meta.get("input_tokens", 0)
+                    output_tokens += meta.get("output_tokens", 0)
+        self.collector.record(self.source, self.model, "ok", self._elapsed(run_id),
+                              prompt_tokens=prompt_tokens, output_tokens=output_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self.collector.record(self.source, self.model, "error", self._elapsed(run_id), error=type(error).__name__)
+
+    def _elapsed(self, run_id) -> float:
+        started = self._started.pop(run_id, None)
+        return time.perf_counter() - started if started is not None else 0.0
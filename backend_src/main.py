@@ -1,23 +1,35 @@
 import sqlite3
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, send_file, stream_with_context
 from flask_cors import CORS
+from werkzeug.utils import secure_filename
 import json,os
 from io_operation import PDFProcessor
+from artifact_cache import ArtifactCache
+from jobs import JobManager, QueueFullError
+from analysis_log import ANALYSIS_PATH, log_path_for, read_log
+from llm_metrics import metrics as llm_metrics
 from logger_config import logging 
-from evaluate_student import calculate_score_and_generate_report
+from evaluate_student import calculate_score_and_generate_report, grade_answer_sheets, save_json, summarize_report
+import shutil
 import tempfile
+import time
+import zipfile
 from utils.get_keys import load_config
 import sys 
 from pathlib import Path
 from gemi_rag import start_RAG
 from explain_gem import Assistant
+from question_bank import prepare_question_paper
+from cohort_grading import grade_cohort, parse_answer_sheets
+from marking import MarkingScheme
+from arrow_export import export_results
+from database import PERFORMANCE_DIMENSIONS, db, student_performance
 
 app = Flask(__name__)
 CORS(app)
 objs = PDFProcessor()
-
-global analysis_over
-analysis_over=False
+artifact_cache = ArtifactCache()
+job_manager = JobManager()
 
 # Function to save the uploaded file as a PDF
 def save_uploaded_file(file, file_type):
@@ -27,10 +39,29 @@ def save_uploaded_file(file, file_type):
     file.save(temp_file_path)  # Save the uploaded file
     return temp_file_path
 
+def save_uploaded_sheets(files, zip_file=None):
+    """Saves a list of uploaded answer sheets, and the PDFs inside an optional ZIP, to a temp directory."""
+    temp_dir = tempfile.mkdtemp()
+    paths = []
+    for i, file in enumerate(files):
+        temp_file_path = os.path.join(temp_dir, f"ans_sheet_{i}.pdf")
+        file.save(temp_file_path)
+        paths.append(temp_file_path)
+    if zip_file:
+        with zipfile.ZipFile(zip_file) as archive:
+            for i, name in enumerate(archive.namelist()):
+                if not name.lower().endswith(".pdf"):
+                    continue
+                # Never trust member paths from the archive
+                temp_file_path = os.path.join(temp_dir, f"zip_{i}_{os.path.basename(name)}")
+                with archive.open(name) as src, open(temp_file_path, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+                paths.append(temp_file_path)
+    return paths
+
 @app.route("/post_db",methods=["POST"])
 def post_db():
-    global analysis_over
-    analysis_over=False
+    """Queues the upload for processing and returns a job ID to poll at /jobs/<id>."""
     current_dir = Path(__file__).parent.resolve()
     parent_dir = current_dir.parent
     sys.path.append(str(parent_dir))
@@ -44,31 +75,221 @@ def post_db():
     ans_key_file_path = save_uploaded_file(ans_key, "ans_key")
     ans_sh_file_path = save_uploaded_file(ans_sh, "ans_sheet")
 
-    student_answers,sid,qid = objs.process_pdf(file_type='answer_sheet',path=ans_sh_file_path)
-    objs.process_pdf(file_type='',path=ans_key_file_path)
-    
-    logging.info(f"Answer sheet and key extraction completed successfully. Output saved at: generated_files")
+    try:
+        job = job_manager.submit("post_db", process_upload, question_file_path, ans_key_file_path, ans_sh_file_path)
+    except QueueFullError as e:
+        return jsonify({"error": f"Server busy: {e}"}), 503
+    return jsonify({"job_id": job.id}), 202
 
+def process_upload(job, question_file_path, ans_key_file_path, ans_sh_file_path):
+    """Background job behind /post_db: extraction, analysis, grading and report writing."""
+    # Each job gets its own processor; the answer key lives on the instance
+    processor = PDFProcessor()
+
+    job.set_stage("extracting")
+    student_answers,sid,qid = processor.process_pdf(file_type='answer_sheet',path=ans_sh_file_path)
+    # Checked before any analysis is paid for; the report is keyed on both IDs
+    if sid is None:
+        raise ValueError("Student ID not found on answer sheet")
+    
     #Populating Question paper DB
-    result,id = objs.merge_answers_with_questions(quest_paper=objs.extract_questions(question_file_path,out = f"generated_files/Question_paper_"))
+    result,id = prepare_question_paper(processor, question_file_path, ans_key_file_path, artifact_cache)
+    job.paper_id = id
+    if qid != id:
+        raise ValueError(f"Answer sheet is for question paper {qid}, expected {id}")
+    logging.info(f"Answer sheet and key extraction completed successfully. Output saved at: generated_files")
 
     #Populating Analysis LLM Output DB
-    output_path = 'generated_files/analysis.json'
-    Assistant(result,id, model_name  = "gemini-2.0-flash-exp",output_path=output_path)
+    job.set_stage("analysing")
+    job.set_progress(0, len(result))
+    output_path = ANALYSIS_PATH
+    job_metrics = llm_metrics.child()
+    Assistant(result,id, model_name  = "gemini-2.0-flash-exp",output_path=output_path,progress=job.set_progress,
+              on_result=lambda qno, analysis: job.publish("analysis", {"Question no": qno, "analysis": analysis}),
+              metrics=job_metrics)
 
     logging.info(f"Analysis Generation completed successfully. Output saved at: {output_path}")
     
-    results = calculate_score_and_generate_report(qid,sid,student_answers = student_answers)
-
+    job.set_stage("grading")
+    results = calculate_score_and_generate_report(qid,sid,student_answers = student_answers,
+                                                  on_row=lambda row: job.publish("graded", row))
 
+    job.set_stage("writing_report")
+    save_json(results, f"{processor.outpath}/{sid}/eval_report_{qid}.json")
     output_path = 'generated_files/eval_report.json'
     with open(output_path, 'w',encoding='utf-8') as f:
         json.dump(results, f, indent=4)
 
-    analysis_over=True
     logging.info(f"Evaluation for student:{student_answers['Student ID']} completed successfully. Output saved in DB")
     logging.info(f"Starting RAG on Evaluation Report for student:{student_answers['Student ID']}")
-    return {}
+    return {"Student ID": sid, "Question Paper ID": qid, **summarize_report(results), "llm": job_metrics.summary()}
+
+@app.route("/jobs/<job_id>",methods=["GET"])
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+@app.route("/post_db_batch",methods=["POST"])
+def post_db_batch():
+    """
+    Queues grading of many answer sheets against one question paper and answer key, and
+    returns a job ID to poll at /jobs/<id>.
+    """
+    load_config('../configs/config.yaml')
+
+    question_file_path = save_uploaded_file(request.files["question"], "question")
+    ans_key_file_path = save_uploaded_file(request.files["anskey"], "ans_key")
+    sheet_paths = save_uploaded_sheets(request.files.getlist("ans_sheets"), request.files.get("ans_zip"))
+    if not sheet_paths:
+        return jsonify({"error": "No answer sheets provided"}), 400
+
+    try:
+        job = job_manager.submit("post_db_batch", process_batch, question_file_path, ans_key_file_path, sheet_paths)
+    except QueueFullError as e:
+        return jsonify({"error": f"Server busy: {e}"}), 503
+    return jsonify({"job_id": job.id}), 202
+
+def process_batch(job, question_file_path, ans_key_file_path, sheet_paths):
+    """Background job behind /post_db_batch: the paper is parsed and analysed once, then every sheet graded."""
+    start = time.perf_counter()
+    job.set_stage("extracting")
+    result,id = prepare_question_paper(PDFProcessor(), question_file_path, ans_key_file_path, artifact_cache)
+    job.paper_id = id
+
+    job.set_stage("analysing")
+    job.set_progress(0, len(result))
+    batch_metrics = llm_metrics.child()
+    Assistant(result,id, model_name  = "gemini-2.0-flash-exp",output_path=ANALYSIS_PATH,progress=job.set_progress,
+              on_result=lambda qno, analysis: job.publish("analysis", {"Question no": qno, "analysis": analysis}),
+              metrics=batch_metrics)
+    logging.info(f"Question paper {id} ready, grading {len(sheet_paths)} answer sheets")
+
+    job.set_stage("grading")
+    job.set_progress(0, len(sheet_paths))
+    def on_summary(done, summary):
+        job.publish("student", summary)
+        job.set_progress(done, len(sheet_paths))
+    summaries = grade_answer_sheets(sheet_paths, qid=id, on_summary=on_summary)
+    elapsed = time.perf_counter() - start
+    graded = sum(1 for summary in summaries if "error" not in summary)
+    logging.info(f"Graded {graded}/{len(sheet_paths)} answer sheets for {id} in {elapsed:.1f}s")
+    return {
+        "Question Paper ID": id,
+        "graded": graded,
+        "failed": len(summaries) - graded,
+        "elapsed_seconds": round(elapsed, 3),
+        "students": summaries,
+        "llm": batch_metrics.summary(),
+    }
+
+@app.route("/grade_cohort",methods=["POST"])
+def grade_cohort_route():
+    """
+    Queues scoring of a whole cohort of answer sheets against one question paper, without
+    per-question feedback, and returns a job ID to poll at /jobs/<id>. An optional
+    "marking_scheme" form field holds JSON such as
+    {"correct": 4, "wrong": -1, "unattempted": 0, "partial": {"12": {"3": 2}}}.
+    """
+    load_config('../configs/config.yaml')
+    try:
+        scheme = MarkingScheme.from_dict(request.form.get("marking_scheme", ""))
+    except (ValueError, AttributeError) as e:
+        return jsonify({"error": f"Invalid marking_scheme: {e}"}), 400
+
+    question_file_path = save_uploaded_file(request.files["question"], "question")
+    ans_key_file_path = save_uploaded_file(request.files["anskey"], "ans_key")
+    sheet_paths = save_uploaded_sheets(request.files.getlist("ans_sheets"), request.files.get("ans_zip"))
+    if not sheet_paths:
+        return jsonify({"error": "No answer sheets provided"}), 400
+
+    try:
+        job = job_manager.submit("grade_cohort", process_cohort, question_file_path, ans_key_file_path, sheet_paths, scheme)
+    except QueueFullError as e:
+        return jsonify({"error": f"Server busy: {e}"}), 503
+    return jsonify({"job_id": job.id}), 202
+
+def process_cohort(job, question_file_path, ans_key_file_path, sheet_paths, scheme):
+    """Background job behind /grade_cohort: analysis for the breakdowns, then cohort scoring."""
+    start = time.perf_counter()
+    job.set_stage("extracting")
+    # Subject, topic and difficulty breakdowns need the paper's analysis
+    result,id = prepare_question_paper(PDFProcessor(), question_file_path, ans_key_file_path, artifact_cache)
+    job.paper_id = id
+
+    job.set_stage("analysing")
+    job.set_progress(0, len(result))
+    cohort_metrics = llm_metrics.child()
+    Assistant(result,id, model_name  = "gemini-2.0-flash-exp",output_path=ANALYSIS_PATH,progress=job.set_progress,
+              on_result=lambda qno, analysis: job.publish("analysis", {"Question no": qno, "analysis": analysis}),
+              metrics=cohort_metrics)
+
+    job.set_stage("grading")
+    sheets, errors = parse_answer_sheets(sheet_paths)
+    for sheet in sheets:
+        if sheet["Student ID"] is None:
+            errors.append({"file": sheet["file"], "error": "Student ID not found on answer sheet"})
+        elif sheet["Question Paper ID"] != id:
+            errors.append({"file": sheet["file"], "error": f"Answer sheet is for question paper {sheet['Question Paper ID']}, expected {id}"})
+    sheets = [sheet for sheet in sheets if sheet["Student ID"] is not None and sheet["Question Paper ID"] == id]
+
+    cohort = grade_cohort(id, sheets, scheme)
+    job.set_progress(len(cohort), len(sheet_paths))
+    elapsed = time.perf_counter() - start
+    logging.info(f"Graded a cohort of {len(cohort)}/{len(sheet_paths)} answer sheets for {id} in {elapsed:.1f}s")
+    return {
+        "Question Paper ID": id,
+        "marking_scheme": scheme.to_dict(),
+        "graded": len(cohort),
+        "failed": len(errors),
+        "elapsed_seconds": round(elapsed, 3),
+        "summary": cohort.summary(),
+        "students": cohort.students(),
+        "errors": errors,
+        "llm": cohort_metrics.summary(),
+    }
+
+@app.route("/performance/<student_id>",methods=["GET"])
+def performance(student_id):
+    """
+    A student's score, attempted, correct and wrong counts per paper, overall and per Subject,
+    Topic, Difficulty and Taxonomy, read from the aggregate table. Optional paper_id and
+    dimension query parameters narrow the result.
+    """
+    dimension = request.args.get("dimension")
+    if dimension is not None and dimension not in PERFORMANCE_DIMENSIONS:
+        return jsonify({"error": f"dimension must be one of {', '.join(PERFORMANCE_DIMENSIONS)}"}), 400
+    result = student_performance(db.connection().cursor(), student_id, request.args.get("paper_id"), dimension)
+    if not result:
+        return jsonify({"error": "No graded attempts found"}), 404
+    return jsonify({"Student ID": student_id, "papers": result})
+
+@app.route("/export",methods=["GET"])
+def export():
+    """
+    Downloads graded report rows as Parquet (default) or, with format=arrow, as an Arrow IPC
+    file that can be memory-mapped. Optional paper_id and student_id query parameters narrow
+    the export. The file is built in batches on disk and streamed from there.
+    """
+    fmt = request.args.get("format", "parquet")
+    if fmt not in ("parquet", "arrow"):
+        return jsonify({"error": "format must be 'parquet' or 'arrow'"}), 400
+    paper_id = request.args.get("paper_id")
+    temp_dir = tempfile.mkdtemp()
+    # paper_id comes from the client, so only a sanitised form of it goes into the file name
+    name = f"results_{secure_filename(paper_id or '') or 'all'}.{fmt}"
+    path = os.path.join(temp_dir, name)
+    export_results(path, paper_id=paper_id, student_id=request.args.get("student_id"), fmt=fmt)
+    response = send_file(path, as_attachment=True, download_name=name,
+                         mimetype="application/vnd.apache.arrow.file" if fmt == "arrow" else "application/vnd.apache.parquet")
+    response.call_on_close(lambda: shutil.rmtree(temp_dir, ignore_errors=True))
+    return response
+
+@app.route("/metrics/llm",methods=["GET"])
+def llm_metrics_summary():
+    """Process-wide LLM call summary over the most recent calls, for quota and capacity planning."""
+    return jsonify(llm_metrics.summary())
 
 @app.route('/rag', methods=['POST'])
 def rag():
@@ -81,24 +302,68 @@ def rag():
     else:
         return jsonify({'error': 'No question provided'}), 400
 
+@app.route("/jobs/<job_id>/stream",methods=["GET"])
+def job_stream(job_id):
+    """
+    Server-sent events for a job: "stage" changes, one "analysis" per question, one "graded"
+    per report row (sent together once the sheet's report is saved) or, for /post_db_batch, one
+    "student" summary per graded sheet, then "done" or "failed".
+    Reconnecting clients resume via Last-Event-ID.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    try:
+        start = int(request.headers.get("Last-Event-ID", -1)) + 1
+    except ValueError:
+        start = 0
+
+    def generate():
+        for item in job.events(start):
+            if item is None:
+                yield ": keepalive\n\n"
+                continue
+            index, event, data = item
+            yield f"id: {index}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.route("/json_file",methods=["GET"])
 def json_file():
-    file_path = os.path.join('generated_files', 'analysis.json')
-    if analysis_over:
-        return jsonify({"message":"done"})
+    """
+    Returns the analyses of the job's paper. With `offset`, returns only those appended to
+    the paper's analysis log since that byte offset, plus the offset to poll from next, and
+    "done" once the job has finished and the log is drained. Without it, returns every
+    analysis as {question_no: analysis} until the job has finished, then "done".
+    """
+    # Clients pass the job ID from /post_db; older clients follow the latest upload
+    job_id = request.args.get("job_id")
+    job = job_manager.get(job_id) if job_id else job_manager.latest("post_db")
+    finished = job is not None and job.finished
+    legacy = "offset" not in request.args
     try:
-        if os.path.exists(file_path):
-            with open(file_path, 'r',encoding='utf-8') as file:
-                data = json.load(file)
-                d={}
-                for i in data.keys():
-                    if "error" in data[i].keys():
-                        continue
-                    d[i]=data[i]
-            return jsonify(d)
-    except:
+        offset = int(request.args.get("offset", 0))
+    except ValueError:
+        return jsonify({"error": "offset must be an integer"}), 400
+    if legacy and finished:
+        return jsonify({"message":"done"})
+
+    paper_id = job.paper_id if job is not None else None
+    log_path = log_path_for(ANALYSIS_PATH, paper_id)
+    records, next_offset = read_log(log_path, offset) if paper_id is not None else ([], offset)
+    if finished and not records:
+        return jsonify({"message":"done", "offset": next_offset})
+    if not records and not os.path.exists(log_path):
         return jsonify({"error": "File not found"}), 404
-    return jsonify({"error": "File not found"}), 404
+    d={}
+    for record in records:
+        if record["paper"] != paper_id or "error" in record["analysis"].keys():
+            continue
+        d[str(record["qno"])]=record["analysis"]
+    if legacy:
+        return jsonify(d)
+    return jsonify({"data": d, "offset": next_offset})
 
 # @app.route("/test",methods=["GET"])
 # def test():
@@ -117,4 +382,5 @@ def json_file():
 if __name__ == "__main__":
     directory_path = "Database"
     os.makedirs(directory_path, exist_ok=True)
+    db.ensure_schema()
     app.run(debug=True, port=5000, use_reloader=False)
@@ -0,0 +1,86 @@
+import json
+import os
+
+import numpy as np
+
+# Option codes used in answer arrays: 1-4 are the options themselves
+UNATTEMPTED = 0
+INVALID_OPTION = 5
+OPTION_CODES = 6
+
+# Default marking scheme, overridable per deployment
+MARKS_CORRECT = float(os.environ.get("MARKS_CORRECT", 4))
+MARKS_WRONG = float(os.environ.get("MARKS_WRONG", -1))
+MARKS_UNATTEMPTED = float(os.environ.get("MARKS_UNATTEMPTED", 0))
+
+# Upper bounds (inclusive) of the difficulty bands used in score breakdowns
+DIFFICULTY_BANDS = (("Easy", 2.0), ("Medium", 3.5), ("Hard", float("inf")))
+
+def difficulty_band(diff) -> str:
+    try:
+        diff = float(diff)
+    except (TypeError, ValueError):
+        return "Unknown"
+    return next(name for name, upper in DIFFICULTY_BANDS if diff <= upper)
+
+def option_number(option) -> int:
+    """1-4 for an option, UNATTEMPTED for an unattempted answer and INVALID_OPTION for anything else."""
+    if option == "Unattempted":
+        return UNATTEMPTED
+    try:
+        number = int(str(option).strip())
+    except ValueError:
+        return INVALID_OPTION
+    return number if 1 <= number <= 4 else INVALID_OPTION
+
+class MarkingScheme:
+    """
+    Marks awarded per answer: `correct` for the key option, `wrong` for any other option
+    (negative marking when below zero) and `unattempted` for a blank. `partial` maps
+    question numbers to {option: marks} overrides, e.g. half marks for a near miss or full
+    marks for a second accepted option.
+    """
+    def __init__(self, correct: float = MARKS_CORRECT, wrong: float = MARKS_WRONG,
+                 unattempted: float = MARKS_UNATTEMPTED, partial: dict = None):
+        self.correct = correct
+        self.wrong = wrong
+        self.unattempted = unattempted
+        self.partial = {int(qno): {int(option): marks for option, marks in options.items()}
+                        for qno, options in (partial or {}).items()}
+
+    def table(self, qnos, key_options) -> np.ndarray:
+        """
+        Marks for every question and option code, shape (questions, OPTION_CODES), so a
+        matrix of option codes is scored with one fancy-indexing lookup. Questions whose
+        key option is unknown give no marks for any option, only partial overrides.
+        """
+        marks = np.full((len(qnos), OPTION_CODES), self.wrong, dtype=np.float64)
+        marks[:, UNATTEMPTED] = self.unattempted
+        known = (key_options >= 1) & (key_options <= 4)
+        marks[np.flatnonzero(known), key_options[known]] = self.correct
+        if self.partial:
+            positions = {qno: i for i, qno in enumerate(np.asarray(qnos).tolist())}
+            for qno, options in self.partial.items():
+                for option, value in options.items():
+                    if qno in positions and 1 <= option <= 4:
+                        marks[positions[qno], option] = value
+        # Keep whole-number schemes as integers so scores read as 4 and -1, not 4.0 and -1.0
+        if np.all(marks == np.round(marks)):
+            return marks.astype(np.int64)
+        return marks
+
+    def to_dict(self) -> dict:
+        return {"correct": self.correct, "wrong": self.wrong, "unattempted": self.unattempted,
+                "partial": {str(qno): {str(option): marks for option, marks in options.items()}
+                            for qno, options in self.partial.items()}}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "MarkingScheme":
+        """Builds a scheme from e.g. request JSON; missing fields fall back to the defaults."""
+        if isinstance(data, str):
+            data = json.loads(data) if data.strip() else {}
+        data = data or {}
+        return cls(correct=float(data.get("correct", MARKS_CORRECT)), wrong=float(data.get("wrong", MARKS_WRONG)),
+                   unattempted=float(data.get("unattempted", MARKS_UNATTEMPTED)),
+                   partial={qno: {option: float(marks) for option, marks in options.items()}
+                            for qno, options in (data.get("partial") or {}).items()})
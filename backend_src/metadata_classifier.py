@@ -0,0 +1,128 @@
+import math
+import threading
+from collections import Counter, defaultdict
+
+from database import analysed_questions, analysis_count
+from question_index import normalize_question
+
+# Explain metadata fields predicted locally, besides Difficulty
+LABEL_FIELDS = ("Subject", "Topic", "Taxonomy", "Question_Type")
+NEIGHBOURS = 7
+MIN_TRAINING_ROWS = 50
+MIN_SIMILARITY = 0.25
+MIN_CONFIDENCE = 0.6
+# The shared classifier is retrained once its training rows have grown by this fraction
+RETRAIN_GROWTH = 0.1
+# Only rows Gemini analysed in full are trained on, never the classifier's own output or copies
+TRAINING_SOURCE = "gemini"
+
+def features(question: str, options=()) -> Counter:
+    """Word unigrams and bigrams of the question, plus unigrams of the options."""
+    words = normalize_question(question).split()
+    terms = Counter(words)
+    terms.update(" ".join(words[i:i + 2]) for i in range(len(words) - 1))
+    for option in options:
+        terms.update(f"opt:{word}" for word in normalize_question(option).split())
+    return terms
+
+class MetadataClassifier:
+    """
+    TF-IDF nearest-neighbour classifier for question metadata, trained on analysed questions.
+
+    predict() returns subject, topic, taxonomy and question type as the similarity-weighted
+    vote of the closest training questions, and difficulty as their weighted mean. The
+    prediction is only marked confident when the nearest question is similar enough and
+    both subject and topic win a clear majority of the vote.
+    """
+    def __init__(self, neighbours=NEIGHBOURS, min_similarity=MIN_SIMILARITY, min_confidence=MIN_CONFIDENCE):
+        self.neighbours = neighbours
+        self.min_similarity = min_similarity
+        self.min_confidence = min_confidence
+        self.labels = []
+        self.postings = defaultdict(list)
+        self.idf = {}
+
+    def __len__(self):
+        return len(self.labels)
+
+    def fit(self, rows):
+        """rows: (question, options, labels) with labels holding Difficulty and the LABEL_FIELDS fields."""
+        documents = []
+        for question, options, labels in rows:
+            documents.append(features(question, options))
+            self.labels.append(labels)
+        frequency = Counter(term for terms in documents for term in terms)
+        self.idf = {term: math.log((1 + len(documents)) / (1 + df)) + 1 for term, df in frequency.items()}
+        for doc_id, terms in enumerate(documents):
+            for term, weight in self._vector(terms).items():
+                self.postings[term].append((doc_id, weight))
+        return self
+
+    def _vector(self, terms: Counter) -> dict:
+        vector = {term: (1 + math.log(count)) * self.idf[term] for term, count in terms.items() if term in self.idf}
+        norm = math.sqrt(sum(w * w for w in vector.values())) or 1.0
+        return {term: w / norm for term, w in vector.items()}
+
+    def predict(self, question: str, options=()):
+        """Returns (metadata, confident); metadata uses Explain field names."""
+        scores = defaultdict(float)
+        for term, weight in self._vector(features(question, options)).items():
+            for doc_id, doc_weight in self.postings.get(term, ()):
+                scores[doc_id] += weight * doc_weight
+        nearest = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:self.neighbours]
+        if not nearest:
+            return {}, False
+
+        total = sum(similarity for _, similarity in nearest)
+        metadata, confidence = {}, {}
+        for field in LABEL_FIELDS:
+            votes = Counter()
+            for doc_id, similarity in nearest:
+                votes[self.labels[doc_id][field]] += similarity
+            label, weight = votes.most_common(1)[0]
+            metadata[field] = label
+            confidence[field] = weight / total
+        difficulties = [(float(self.labels[doc_id]["Difficulty"]), similarity) for doc_id, similarity in nearest]
+        metadata["Difficulty"] = round(sum(d * s for d, s in difficulties) / total, 1)
+
+        confident = (nearest[0][1] >= self.min_similarity
+                     and confidence["Subject"] >= self.min_confidence
+                     and confidence["Topic"] >= self.min_confidence)
+        return metadata, confident
+
+    @classmethod
+    def from_db(cls, connection, **kwargs):
+        """Trains on every question Gemini analysed in full; returns None below MIN_TRAINING_ROWS."""
+        rows = []
+        for _, _, question, op1, op2, op3, op4, _, diff, subject, topic, taxonomy, question_type in analysed_questions(
+                connection.cursor(), source=TRAINING_SOURCE):
+            try:
+                difficulty = float(diff)
+            except (TypeError, ValueError):
+                continue
+            labels = dict(zip(LABEL_FIELDS, (subject, topic, taxonomy, question_type)), Difficulty=difficulty)
+            rows.append((question, (op1, op2, op3, op4), labels))
+        if len(rows) < MIN_TRAINING_ROWS:
+            return None
+        return cls(**kwargs).fit(rows)
+
+_classifier = None
+_classifier_rows = 0
+_classifier_lock = threading.Lock()
+
+def trained_classifier(connection):
+    """
+    Process-wide classifier, trained on first use and retrained only once the training rows
+    have grown by RETRAIN_GROWTH since the last fit. None while there are too few rows.
+    """
+    global _classifier, _classifier_rows
+    with _classifier_lock:
+        rows = analysis_count(connection.cursor(), source=TRAINING_SOURCE)
+        if rows < MIN_TRAINING_ROWS:
+            return None
+        if _classifier is None or rows >= _classifier_rows * (1 + RETRAIN_GROWTH):
+            classifier = MetadataClassifier.from_db(connection)
+            if classifier is None:
+                return _classifier
+            _classifier, _classifier_rows = classifier, rows
+        return _classifier
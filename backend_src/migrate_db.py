@@ -0,0 +1,108 @@
+"""
+One-off migration from the per-paper / per-student layout to the single schema in database.py.
+
+Reads the {id}_QP and {id}_LLM tables of the old Questions.db and the report tables of
+every per-student database (by default every other database in Database/, named after
+the student ID, with one table per paper), and imports them
+into papers, questions, analyses, students, attempts and responses, and fills in
+the performance aggregates of every imported attempt. Rows already in
+the target are left alone, so the migration can be re-run safely, and the counts printed
+are the rows actually inserted. Run from backend_src:
+
+    python migrate_db.py --questions Database/Questions.db --students "Database/*.db"
+"""
+import argparse
+import glob
+import os
+import sqlite3
+import time
+
+from database import ANALYSIS_COLUMNS, DB_PATH, connect, refresh_performance, start_attempt, table_exists
+from llm_cache import CACHE_PATH
+from logger_config import logging
+
+def legacy_tables(cursor, suffix: str = "") -> list:
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
+    return [name for (name,) in cursor.fetchall() if name.endswith(suffix)]
+
+def migrate_questions(source_path: str, target) -> dict:
+    """Imports every {id}_QP table and its {id}_LLM table. Returns per-table counts of inserted rows."""
+    source = sqlite3.connect(source_path)
+    counts = {"papers": 0, "questions": 0, "analyses": 0}
+    try:
+        cursor = source.cursor()
+        columns = ", ".join(ANALYSIS_COLUMNS)
+        with target:
+            for table in legacy_tables(cursor, "_QP"):
+                paper_id = table[:-len("_QP")]
+                # rowcount only counts the rows a statement itself inserted, not ignored ones or trigger writes
+                counts["papers"] += target.execute("INSERT OR IGNORE INTO papers (paper_id, created_at) VALUES (?, ?)",
+                                                   (paper_id, os.path.getmtime(source_path))).rowcount
+                rows = cursor.execute(f"SELECT Qno, Question, op1, op2, op3, op4, correct_op FROM {paper_id}_QP").fetchall()
+                counts["questions"] += target.executemany('''
+                INSERT OR IGNORE INTO questions (paper_id, qno, Question, op1, op2, op3, op4, correct_op)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', [(paper_id, *row) for row in rows]).rowcount
+                if not table_exists(cursor, f"{paper_id}_LLM"):
+                    continue
+                rows = cursor.execute(f"SELECT Qno, {columns} FROM {paper_id}_LLM").fetchall()
+                counts["analyses"] += target.executemany(f'''
+                INSERT OR IGNORE INTO analyses (paper_id, qno, {columns})
+                VALUES (?, ?, {", ".join("?" * len(ANALYSIS_COLUMNS))})''', [(paper_id, *row) for row in rows]).rowcount
+    finally:
+        source.close()
+    return counts
+
+def migrate_student(source_path: str, target) -> int:
+    """
+    Imports one per-student database, named after the student ID, with one report table
+    per paper. Papers missing from the question tables get placeholder question rows
+    so the report can still be read back. Returns the number of responses inserted.
+    """
+    student_id = os.path.splitext(os.path.basename(source_path))[0]
+    source = sqlite3.connect(source_path)
+    imported = 0
+    try:
+        cursor = source.cursor()
+        for paper_id in legacy_tables(cursor):
+            rows = cursor.execute(f"SELECT Qno, Question, stud_op, Score, Error_exp, Feedback FROM {paper_id}").fetchall()
+            with target:
+                target.execute("INSERT OR IGNORE INTO papers (paper_id, created_at) VALUES (?, ?)", (paper_id, time.time()))
+                target.executemany('''
+                INSERT OR IGNORE INTO questions (paper_id, qno, Question, op1, op2, op3, op4, correct_op)
+                VALUES (?, ?, ?, 'NA', 'NA', 'NA', 'NA', 'NA')''', [(paper_id, qno, question) for qno, question, *_ in rows])
+            attempt_id = start_attempt(student_id, paper_id, target)
+            with target:
+                imported += target.executemany('''
+                INSERT OR IGNORE INTO responses (attempt_id, qno, stud_op, Score, Error_exp, Feedback)
+                VALUES (?, ?, ?, ?, ?, ?)''', [(attempt_id, qno, *rest) for qno, _, *rest in rows]).rowcount
+                refresh_performance(target, attempt_id)
+    finally:
+        source.close()
+    return imported
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", default="Database/Questions.db", help="Old question paper database")
+    parser.add_argument("--students", default="Database/*.db",
+                        help="Glob of old per-student databases; the questions, target and LLM cache databases are skipped")
+    parser.add_argument("--target", default=DB_PATH)
+    args = parser.parse_args()
+
+    target = connect(args.target)
+    try:
+        if os.path.exists(args.questions):
+            counts = migrate_questions(args.questions, target)
+            logging.info(f"Migrated {args.questions}: {counts}")
+            print(f"{args.questions}: {counts}")
+        skipped = {os.path.abspath(path) for path in (args.questions, args.target, CACHE_PATH)}
+        for path in sorted(glob.glob(args.students)):
+            if os.path.abspath(path) in skipped:
+                continue
+            imported = migrate_student(path, target)
+            logging.info(f"Migrated {path}: {imported} responses inserted")
+            print(f"{path}: {imported} responses inserted")
+    finally:
+        target.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import json
+import math
+import random
+import re
+import threading
+import time
+from typing import Callable, Optional
+
+from google.api_core import exceptions as genai_exceptions
+
+def constant_latency(seconds: float) -> Callable[[random.Random], float]:
+    return lambda rng: seconds
+
+def uniform_latency(low: float, high: float) -> Callable[[random.Random], float]:
+    return lambda rng: rng.uniform(low, high)
+
+def lognormal_latency(median: float, sigma: float = 0.5) -> Callable[[random.Random], float]:
+    """Long-tailed latency, which is closer to what a hosted LLM endpoint looks like."""
+    return lambda rng: rng.lognormvariate(math.log(median), sigma)
+
+def canned_explanation(question: str = "", options: Optional[dict] = None, correct_option="1") -> dict:
+    """An Explain-shaped analysis with placeholder text."""
+    wrong = [k for k in (options or {"1": "", "2": "", "3": "", "4": ""}) if str(k) != str(correct_option)]
+    return {
+        "Question": question,
+        "Options": options or {},
+        "correct_option": str(correct_option),
+        "Subject": "Physics",
+        "Topic": "Kinematics",
+        "sub_topic": "Motion in a straight line",
+        "Taxonomy": "Application",
+        "Question_Type": "Calculative",
+        "Correct_Answer_Explanation": "Offline stand-in explanation of the correct answer.",
+        "Incorrect_Option_Analysis": {
+            str(k): {"Type_of_Error": "Conceptual Error", "Description": "Offline stand-in analysis."} for k in wrong
+        },
+        "Common_Student_Misconceptions": "Offline stand-in misconceptions.",
+        "Difficulty": 2.5,
+        "Positive_Feedback": "Offline stand-in positive feedback.",
+        "Negative_Feedback": "Offline stand-in negative feedback.",
+    }
+
+class OfflineUsage:
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+
+class OfflineResponse:
+    def __init__(self, text: str, prompt: str):
+        self.text = text
+        # Same rough 4-characters-per-token estimate the key scheduler uses
+        self.usage_metadata = OfflineUsage(len(prompt) // 4, len(text) // 4)
+
+class OfflineGenerativeModel:
+    """
+    Local stand-in for explain_gem.GeminiClient, for load-testing the analysis pipeline
+    without network access or API quota.
+
+    Each call sleeps for a latency drawn from `latency`, raises ResourceExhausted with
+    probability `exhausted_rate`, returns truncated JSON with probability `malformed_rate`,
+    and otherwise answers with canned Explain-shaped output for every question in the
+    prompt (single-question and batched prompts are both understood). Call counts and
+    latencies are recorded in `stats` for benchmarks.
+    """
+    def __init__(self, model_name: str = "offline", generation_config: Optional[dict] = None,
+                 latency: Callable[[random.Random], float] = lognormal_latency(0.05),
+                 exhausted_rate: float = 0.0, malformed_rate: float = 0.0, seed: Optional[int] = None):
+        self.model_name = model_name
+        self.generation_config = generation_config or {}
+        self.latency = latency
+        self.exhausted_rate = exhausted_rate
+        self.malformed_rate = malformed_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "exhausted": 0, "malformed": 0, "latencies": []}
+
+    def generate_content(self, prompt: str, generation_config=None) -> OfflineResponse:
+        with self._lock:
+            delay = self.latency(self._rng)
+            roll = self._rng.random()
+            self.stats["calls"] += 1
+        start = time.perf_counter()
+        time.sleep(max(0.0, delay))
+
+        with self._lock:
+            self.stats["latencies"].append(time.perf_counter() - start)
+            if roll < self.exhausted_rate:
+                self.stats["exhausted"] += 1
+                raise genai_exceptions.ResourceExhausted("Offline stand-in quota exceeded")
+            malformed = roll < self.exhausted_rate + self.malformed_rate
+            if malformed:
+                self.stats["malformed"] += 1
+
+        text = json.dumps(self._answer(prompt), ensure_ascii=False)
+        if malformed:
+            text = text[:len(text) // 2]
+        return OfflineResponse(text, prompt)
+
+    def _answer(self, prompt: str):
+        if "Questions:\n" in prompt:
+            # Batched prompt: one JSON object per line after the "Questions:" header
+            answers = []
+            for line in prompt.split("Questions:\n", 1)[1].strip().splitlines():
+                entry = json.loads(line)
+                answer = canned_explanation(entry["Question"], entry["Options"], entry["Correct Answer"])
+                answer["Question_no"] = entry["Question_no"]
+                answers.append(answer)
+            return answers
+        question = re.search(r"Question: (.*?)\s+(?:# <--|Options:)", prompt, re.DOTALL)
+        correct = re.search(r"Correct Answer: (\S+)", prompt)
+        return canned_explanation(question.group(1) if question else "", {}, correct.group(1) if correct else "1")
+
+def offline_client_factory(seed: Optional[int] = None, **kwargs) -> Callable[[str], OfflineGenerativeModel]:
+    """
+    Builds an AIModelEvaluator client_factory handing every API key its own offline model.
+    With a seed, model i is seeded seed + i, so keys fail independently yet reproducibly.
+    """
+    models = []
+    def factory(api_key: str) -> OfflineGenerativeModel:
+        model = OfflineGenerativeModel(seed=None if seed is None else seed + len(models), **kwargs)
+        models.append(model)
+        return model
+    factory.models = models
+    return factory
@@ -0,0 +1,44 @@
+"""
+Offline question-bank prewarm.
+
+Extracts, loads and analyses question papers ahead of time, so a later /post_db for
+the same paper goes straight to grading. Question papers and answer keys are paired
+by Question Paper ID; answer keys need "key", "anskey" or "answerkey" as a separate word
+in the file name, e.g. qp1_key.pdf or "Answer Key qp1.pdf". Progress is saved to
+generated_files/prewarm_progress.json and finished papers are skipped on the next run.
+Run from backend_src:
+
+    python prewarm.py ../raw_data/papers --papers 2 --concurrency 8
+"""
+import argparse
+import json
+
+from artifact_cache import ArtifactCache
+from explain_gem import DEFAULT_BATCH_SIZE, DEFAULT_CONCURRENCY
+from question_bank import PROGRESS_PATH, PrewarmProgress, find_pairs, prewarm
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="Directory of question paper and answer key PDFs")
+    parser.add_argument("--papers", type=int, default=1, help="Papers processed at the same time")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Gemini requests in flight per paper")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--progress", default=PROGRESS_PATH, help="Progress file used to resume")
+    parser.add_argument("--force", action="store_true", help="Re-run papers already marked done")
+    parser.add_argument("--list", action="store_true", help="Only print the paper / answer key pairs")
+    args = parser.parse_args()
+
+    pairs, unpaired = find_pairs(args.directory)
+    for path in unpaired:
+        print(f"Skipping unpaired file: {path}")
+    if args.list:
+        for paper_id, question_path, anskey_path in pairs:
+            print(f"{paper_id}: {question_path} + {anskey_path}")
+        return
+
+    statuses = prewarm(pairs, ArtifactCache(), PrewarmProgress(args.progress), papers=args.papers, force=args.force,
+                       concurrency=args.concurrency, batch_size=args.batch_size)
+    print(json.dumps(statuses, indent=4))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from analysis_log import ANALYSIS_PATH
+from database import db, missing_analyses, paper_exists
+from explain_gem import Assistant
+from io_operation import PDFProcessor, QUESTION_PAPER_ID_PATTERN, STUDENT_ID_PATTERN
+from logger_config import logging
+
+PROGRESS_PATH = "generated_files/prewarm_progress.json"
+# File names with one of these as a whole word are treated as answer keys when scanning a
+# directory, e.g. "qp1_key.pdf" or "Answer Key qp1.pdf", but not "keyboard_quiz.pdf"
+ANSWER_KEY_MARKERS = ("key", "keys", "anskey", "answerkey")
+
+def is_answer_key(name: str) -> bool:
+    """Whether a file name marks an answer key: one of its words, split on anything but letters and digits, is a marker."""
+    words = re.split(r"[^a-z0-9]+", os.path.splitext(name)[0].lower())
+    return any(word in ANSWER_KEY_MARKERS for word in words)
+
+def paper_loaded(id):
+    """A cached paper is only usable while its questions are still in the database."""
+    return paper_exists(db.connection().cursor(), id)
+
+def paper_analysed(id) -> bool:
+    """True once every question of the paper has an analysis row."""
+    cursor = db.connection().cursor()
+    return paper_exists(cursor, id) and not missing_analyses(cursor, id)
+
+def prepare_question_paper(processor, question_file_path, ans_key_file_path, artifact_cache):
+    """Extracts the answer key and question paper, and loads the merged paper into the database."""
+    key = artifact_cache.key_for(question_file_path, ans_key_file_path)
+    artifact = artifact_cache.get(key)
+    if artifact and paper_loaded(artifact["paper_id"]):
+        processor.answer_key = artifact["answer_key"]
+        return artifact["questions"], artifact["paper_id"]
+
+    processor.process_pdf(file_type='',path=ans_key_file_path)
+    result,id = processor.merge_answers_with_questions(quest_paper=processor.extract_questions(question_file_path,out = f"generated_files/Question_paper_"))
+    artifact_cache.put(key, {"questions": result, "answer_key": processor.answer_key, "paper_id": id})
+    return result,id
+
+def document_ids(path):
+    """Reads (Question Paper ID, Student ID or None) from the first page that has a paper ID."""
+    for page in PDFProcessor().iter_pdf_pages(path):
+        match = QUESTION_PAPER_ID_PATTERN.search(page.lower())
+        if match:
+            student = STUDENT_ID_PATTERN.search(page.lower())
+            return match.group(1), student.group(1) if student else None
+    return "Unknown", None
+
+def find_pairs(directory):
+    """
+    Pairs the question papers and answer keys in a directory by their Question Paper ID.
+    Answer keys are recognised by their file name (see is_answer_key), and student
+    answer sheets (anything with a Student ID) are left out. Returns
+    ([(paper_id, question_path, anskey_path)], [unpaired paths]).
+    """
+    keys, papers = {}, {}
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not name.lower().endswith(".pdf"):
+            continue
+        paper_id, student_id = document_ids(path)
+        if student_id is not None:
+            continue
+        (keys if is_answer_key(name) else papers).setdefault(paper_id, []).append(path)
+
+    pairs, unpaired = [], []
+    for paper_id, question_paths in papers.items():
+        key_paths = keys.pop(paper_id, [])
+        if paper_id == "Unknown" or len(question_paths) != 1 or len(key_paths) != 1:
+            unpaired.extend(question_paths + key_paths)
+            continue
+        pairs.append((paper_id, question_paths[0], key_paths[0]))
+    unpaired.extend(path for paths in keys.values() for path in paths)
+    return pairs, unpaired
+
+class PrewarmProgress:
+    """Per-paper prewarm status, saved atomically after every update so an interrupted run can resume."""
+    def __init__(self, path=PROGRESS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.papers = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.papers = {}
+
+    def done(self, paper_id) -> bool:
+        return self.papers.get(paper_id, {}).get("status") == "done"
+
+    def update(self, paper_id, **fields):
+        with self._lock:
+            self.papers.setdefault(paper_id, {}).update(fields, updated_at=time.time())
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.papers, f, indent=4)
+            os.replace(tmp_path, self.path)
+
+def prewarm_paper(paper_id, question_path, anskey_path, artifact_cache, progress: PrewarmProgress, **assistant_kwargs):
+    start = time.perf_counter()
+    progress.update(paper_id, status="extracting", question=question_path, anskey=anskey_path)
+    questions, id = prepare_question_paper(PDFProcessor(), question_path, anskey_path, artifact_cache)
+
+    def report(done, total):
+        progress.update(id, status="analysing", done=done, total=total)
+    Assistant(questions, id, model_name="gemini-2.0-flash-exp", output_path=ANALYSIS_PATH,
+              progress=report, **assistant_kwargs)
+
+    status = "done" if paper_analysed(id) else "incomplete"
+    progress.update(id, status=status, seconds=round(time.perf_counter() - start, 3))
+    return id, status
+
+def prewarm(pairs, artifact_cache, progress: PrewarmProgress, papers: int = 1, force: bool = False, **assistant_kwargs):
+    """
+    Loads and analyses every (paper_id, question_path, anskey_path) pair, `papers` at a time.
+    Papers recorded as done are skipped unless force is set or their analysis has since gone
+    missing. Each paper still fans its questions out over Assistant's own concurrency, and
+    all papers share one API key pool. Returns {paper_id: status}.
+    """
+    statuses = {}
+    todo = []
+    for paper_id, question_path, anskey_path in pairs:
+        if not force and progress.done(paper_id) and paper_analysed(paper_id):
+            statuses[paper_id] = "skipped"
+        else:
+            todo.append((paper_id, question_path, anskey_path))
+    logging.info(f"Prewarming {len(todo)} of {len(pairs)} papers, {papers} at a time")
+
+    with ThreadPoolExecutor(max_workers=max(1, papers)) as pool:
+        futures = {pool.submit(prewarm_paper, *pair, artifact_cache, progress, **assistant_kwargs): pair[0]
+                   for pair in todo}
+        for future in as_completed(futures):
+            paper_id = futures[future]
+            try:
+                id, statuses[paper_id] = future.result()
+            except Exception as e:
+                logging.error(f"Prewarming {paper_id} failed: {e}")
+                progress.update(paper_id, status="failed", error=str(e))
+                statuses[paper_id] = "failed"
+            logging.info(f"Prewarm {paper_id}: {statuses[paper_id]}")
+    return statuses
@@ -0,0 +1,150 @@
+import hashlib
+import re
+import threading
+
+from database import analysed_qnos, analysed_questions, analysed_questions_after, copy_analysis, question_row
+from llm_cache import normalize_text
+from logger_config import logging
+
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4
+MAX_HAMMING_DISTANCE = 3
+
+def normalize_question(text) -> str:
+    """Normalises question text and drops numbering and punctuation that vary between papers."""
+    text = normalize_text(text)
+    text = re.sub(r"^(q(uestion)?\s*)?\d+\s*[.)]\s*", "", text)
+    return re.sub(r"[^\w]+", " ", text).strip()
+
+def normalize_options(options) -> tuple:
+    """Options in option-number order, normalised like the question text."""
+    return tuple(normalize_question(opt) for opt in options)
+
+def fingerprint(question: str, options: tuple) -> str:
+    """Exact fingerprint of an already normalised question and its options."""
+    return hashlib.sha1("\x1f".join((question,) + options).encode("utf-8")).hexdigest()
+
+def simhash(text: str, bits: int = SIMHASH_BITS) -> int:
+    """SimHash over word bigrams, so reworded or re-punctuated copies land a few bits apart."""
+    words = text.split()
+    features = [" ".join(words[i:i + 2]) for i in range(max(len(words) - 1, 1))]
+    weights = [0] * bits
+    for feature in features:
+        h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=bits // 8).digest(), "big")
+        for bit in range(bits):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit in range(bits) if weights[bit] > 0)
+
+def _bands(value: int, bands: int = SIMHASH_BANDS, bits: int = SIMHASH_BITS):
+    width = bits // bands
+    mask = (1 << width) - 1
+    return [(band, value >> (band * width) & mask) for band in range(bands)]
+
+class QuestionIndex:
+    """
+    Fingerprint index of every analysed question in the database.
+
+    Exact matches are found through a hash of the normalised question and options.
+    Near duplicates are found by splitting each question's SimHash into bands, so
+    any two questions within MAX_HAMMING_DISTANCE bits share at least one band.
+    A match is only reported when the options and correct option are identical,
+    because the stored analysis explains each option individually.
+    """
+    def __init__(self):
+        self.exact = {}
+        self.bands = {}
+        self.entries = []
+        self.database = None
+        self.last_rowid = 0
+
+    def add(self, paper_id: str, qno: int, question: str, options, correct_option):
+        text = normalize_question(question)
+        opts = normalize_options(options)
+        entry = (paper_id, qno, text, opts, str(correct_option).strip(), simhash(text))
+        self.exact.setdefault(fingerprint(text, opts), entry)
+        for band in _bands(entry[5]):
+            self.bands.setdefault(band, []).append(entry)
+        self.entries.append(entry)
+
+    def lookup(self, question: str, options, correct_option, exclude: str = None):
+        """Returns (paper_id, qno) of a reusable analysis, or None."""
+        text = normalize_question(question)
+        opts = normalize_options(options)
+        correct = str(correct_option).strip()
+        entry = self.exact.get(fingerprint(text, opts))
+        if entry and entry[0] != exclude and entry[4] == correct:
+            return entry[0], entry[1]
+        value = simhash(text)
+        best = None
+        for band in _bands(value):
+            for entry in self.bands.get(band, ()):
+                if entry[0] == exclude or entry[3] != opts or entry[4] != correct:
+                    continue
+                distance = bin(entry[5] ^ value).count("1")
+                if distance <= MAX_HAMMING_DISTANCE and (best is None or distance < best[0]):
+                    best = (distance, entry)
+        return (best[1][0], best[1][1]) if best else None
+
+    @classmethod
+    def from_db(cls, connection, exclude: str = None):
+        """Indexes every question that has an analysis, skipping paper `exclude`."""
+        index = cls()
+        for paper_id, qno, question, op1, op2, op3, op4, correct_op, *_ in analysed_questions(connection.cursor(), exclude):
+            index.add(paper_id, qno, question, (op1, op2, op3, op4), correct_op)
+        return index
+
+    def refresh(self, connection) -> int:
+        """Indexes analyses written since the last refresh. Returns the number added."""
+        rows = analysed_questions_after(connection.cursor(), self.last_rowid)
+        for rowid, paper_id, qno, question, op1, op2, op3, op4, correct_op in rows:
+            self.add(paper_id, qno, question, (op1, op2, op3, op4), correct_op)
+            self.last_rowid = rowid
+        return len(rows)
+
+_index = None
+_index_lock = threading.Lock()
+
+def shared_index(connection) -> QuestionIndex:
+    """
+    Process-wide index, brought up to date with analyses saved since it was last used,
+    so each paper costs SimHashes for its new questions rather than for the whole bank.
+    It is rebuilt when the connection points at a different database file.
+    Callers must hold _index_lock while using it.
+    """
+    global _index
+    database = connection.execute("PRAGMA database_list").fetchone()[2]
+    if _index is None or _index.database != database:
+        _index = QuestionIndex()
+        _index.database = database
+    _index.refresh(connection)
+    return _index
+
+def reuse_analyses(questions: list, id: str, connection) -> int:
+    """
+    Copies analyses of duplicate questions from earlier papers to paper id.
+
+    Assistant skips questions that already have an analysis row, so every copied
+    row is one LLM call avoided. Returns the number of questions reused.
+    """
+    if not questions:
+        return 0
+    cursor = connection.cursor()
+    reused = pending = 0
+    with _index_lock, connection:
+        index = shared_index(connection)
+        analysed = analysed_qnos(cursor, id)
+        for question in questions:
+            qno, text, op1, op2, op3, op4, correct_op = question_row(question)
+            if qno in analysed:
+                continue
+            # Only questions still needing an analysis would have cost an LLM call
+            pending += 1
+            match = index.lookup(text, (op1, op2, op3, op4), correct_op, exclude=id)
+            if match:
+                copy_analysis(cursor, match[0], match[1], id, qno)
+                reused += 1
+        indexed = len(index.entries)
+    avoided = reused / pending if pending else 0.0
+    logging.info(f"Reused analyses for {reused} of {pending} unanalysed questions in {id} "
+                 f"({avoided:.0%} of LLM calls avoided, {indexed} indexed)")
+    return reused
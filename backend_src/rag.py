@@ -10,6 +10,7 @@ from langchain_ollama import OllamaEmbeddings
 from langchain_core.runnables import RunnablePassthrough
 import sqlite3
 
+from llm_metrics import MetricsCallbackHandler, metrics
 from logger_config import logging
 
 def initialize_RAG(documents,question):
@@ -61,7 +62,8 @@ def initialize_RAG(documents,question):
         | StrOutputParser()
     )
 
-    results = chain.invoke(question)
+    callback = MetricsCallbackHandler(metrics, source="rag", model="qwen2.5:7b")
+    results = chain.invoke(question, config={"callbacks": [callback]})
 
     return results 
 
@@ -0,0 +1,32 @@
+"""
+Repair pass for a paper's question analysis.
+
+Finds the questions of a paper in the database that have no analysis row, because they
+were never analysed or the model's answer was unusable, and re-analyses only those,
+concurrently. Run from backend_src:
+
+    python repair_analysis.py QP_ID [QP_ID ...] --concurrency 8
+"""
+import argparse
+from database import db, missing_analyses
+from explain_gem import DEFAULT_BATCH_SIZE, DEFAULT_CONCURRENCY, repair_analyses
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paper_ids", nargs="+", help="Question Paper IDs to repair")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--output", default="generated_files/analysis.json")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the questions that would be re-analysed")
+    args = parser.parse_args()
+
+    for paper_id in args.paper_ids:
+        if args.dry_run:
+            print(f"{paper_id}: {missing_analyses(db.connection().cursor(), paper_id)}")
+            continue
+        retried = repair_analyses(paper_id, args.output, concurrency=args.concurrency, batch_size=args.batch_size)
+        still_missing = missing_analyses(db.connection().cursor(), paper_id)
+        print(f"{paper_id}: retried {len(retried)} questions, {len(still_missing)} still missing {still_missing}")
+
+if __name__ == "__main__":
+    main()